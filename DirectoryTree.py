@@ -1,28 +1,10 @@
 import os
+import sys
 import time
 
-def path_split(path, base=''):
-    '''
-    Split a file system path in a list of path components (as a recursive os.path.split()),
-    optionally only up to a given base path.
-    '''
-    if base.endswith(os.path.sep):
-        base = base.rstrip(os.path.sep)
-    items = []
-    while True:
-        if path == base:
-            items.insert(0, path)
-            break
-        path, tail = os.path.split(path)
-        if tail != '':
-            items.insert(0, tail)
-        if path == '':
-            break
-        if path == '/':
-            items.insert(0, path)
-            break
-    return items
-
+from sizehist import SizeHistogram
+from scanengine import path_split
+
 class DirectoryTree(object):
     def __init__(self, path):
         self.name = path
@@ -37,47 +19,55 @@ class DirectoryTree(object):
         self.totAlloc = 0
         self.maxFileSize = -1
         self.maxFileName = ''
-        self.oldFileDate = -1
+        self.oldFileDate = None # no files (below): no date
         self.oldFileName = ''
         self.maxFoldSize = -1
         self.maxFoldName = ''
+        self.sizeHist = SizeHistogram()
 
     def AddFolder(self, du_line):
         # receive a line from du.py: represents one folder and its stats, separated by bars
 
         parts = du_line.split('|')
-        if (len(parts) != 8): # incompatible version of du
+        if (len(parts) != 9): # incompatible version of du
             exit
-        relPath = path_split(parts[7], base=self.name)[1:]
+        relPath = path_split(parts[8], base=self.name)[1:]
 
         # Walk down path and create subnodes if required.
         cursor = self
         for component in relPath:
             if component not in cursor.subnodes:
                 cursor.subnodes[component] = DirectoryTree(component)
-            cursor = cursor.subnodes[component]
+            cursor = cursor.subnodes[component]
+
+        cursor.SetFolder(parts)
+        return cursor
+
+    def SetFolder(self, parts):
+        # Store the stats of a du line (split on bars) in this node
 
         # Store 'our' data to 'self' stats
-        cursor.myCount = int(parts[0])
-        cursor.mySize  = int(parts[1])
-        cursor.myAlloc = int(parts[2])
+        self.myCount = int(parts[0])
+        self.mySize  = int(parts[1])
+        self.myAlloc = int(parts[2])
 
         # Init 'our' total to 'self' data; later accumulation pass
-        cursor.totCount = int(parts[0])
-        cursor.totSize  = int(parts[1])
-        cursor.totAlloc = int(parts[2])
+        self.totCount = int(parts[0])
+        self.totSize  = int(parts[1])
+        self.totAlloc = int(parts[2])
 
-        cursor.totFold += 1
+        self.totFold += 1
 
         # Large file TODO distinguish self / total
-        cursor.maxFileSize = int(parts[4])
-        cursor.maxFileName = parts[3]
+        self.maxFileSize = int(parts[4])
+        self.maxFileName = parts[3]
 
         # Oldest file TODO distinguish self / total
-        cursor.oldFileDate = float(parts[6])
-        cursor.oldFileName = parts[5]
+        self.oldFileDate = float(parts[6]) if parts[6] else None
+        self.oldFileName = parts[5]
 
-        return cursor
+        # Own file size histogram; Accum merges in the subnodes
+        self.sizeHist = SizeHistogram.decode(parts[7])
 
     # TODO accumulate size/count data
     # TODO accumulate large file data
@@ -85,25 +75,43 @@ class DirectoryTree(object):
     def Accum(self):
         for node in self.subnodes.values():
             node.Accum()
-            self.totCount += node.totCount
-            self.totAlloc += node.totAlloc
-            self.totSize  += node.totSize
-            self.totFold  += node.totFold
-
-            if (node.maxFileSize > self.maxFileSize):
-                self.maxFileName = node.maxFileName
-                self.maxFileSize = node.maxFileSize
-            if (node.oldFileDate < self.oldFileDate):
-                self.oldFileName = node.oldFileName
-                self.oldFileDate = node.oldFileDate
+            self.AddTotals(node)
+
+    def AddTotals(self, node):
+        # Roll the (accumulated) totals of a subnode up into this node
+        self.totCount += node.totCount
+        self.totAlloc += node.totAlloc
+        self.totSize  += node.totSize
+        self.totFold  += node.totFold
+        self.sizeHist.merge(node.sizeHist)
+
+        if (node.maxFileSize > self.maxFileSize):
+            self.maxFileName = node.maxFileName
+            self.maxFileSize = node.maxFileSize
+        if node.oldFileDate is not None and (self.oldFileDate is None or node.oldFileDate < self.oldFileDate):
+            self.oldFileName = node.oldFileName
+            self.oldFileDate = node.oldFileDate
 
     # TODO total folder count is off-by-one because it includes 'self'
-    def Dump(self, level=0, maxlevel=99999):
-        print('{1}:{2}({5})-{3}({4}) \'{0}\''.format(self.name, level, self.totCount, self.totSize, self.totAlloc, self.totFold))
-        print('    Large File:\'{0}\'({1})'.format(self.maxFileName, self.maxFileSize))
-        print('    Aged  File:\'{0}\'({1})'.format(self.oldFileName, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(int(self.oldFileDate)))))
-
-        if ( level < maxlevel ):
-            for node in self.subnodes.values():
-                node.Dump(level+1, maxlevel)
+    def Dump(self, level=0, maxlevel=99999, showHist=False, out=None):
+        # Pre-order, without recursion; the lines go out in chunks instead of one print per line
+        out = out or sys.stdout
+        lines = []
+        stack = [(self, level)]
+        while stack:
+            node, level = stack.pop()
+            lines.append('{1}:{2}({5})-{3}({4}) \'{0}\''.format(node.name, level, node.totCount, node.totSize, node.totAlloc, node.totFold))
+            lines.append('    Large File:\'{0}\'({1})'.format(node.maxFileName, node.maxFileSize))
+            oldDate = '' if node.oldFileDate is None else time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(int(node.oldFileDate)))
+            lines.append('    Aged  File:\'{0}\'({1})'.format(node.oldFileName, oldDate))
+            if showHist:
+                lines.append('    Sizes:{0}'.format(node.sizeHist.render()))
+
+            if ( level < maxlevel ):
+                stack.extend((sub, level+1) for sub in reversed(list(node.subnodes.values())))
+            if len(lines) >= 4000:
+                out.write('\n'.join(lines) + '\n')
+                lines = []
+        if lines:
+            out.write('\n'.join(lines) + '\n')
 
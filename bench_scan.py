@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+'''
+Scan engine benchmark: scan a tree with every combination of the scan engine
+metrics (see scanengine.METRICS), and with the front ends for reference
+(duviz.build_du_tree with an extension table and file list, du.iter_du_tree).
+
+By default a synthetic tree (with some hard links) is generated in a
+temporary folder, pass a directory to benchmark an existing tree instead.
+The caches are warm after the first round, so this measures the CPU cost of
+the metrics on top of the walk; see bench_traversal.py for cold cache runs.
+'''
+
+import itertools
+import optparse
+import os
+import shutil
+import tempfile
+import time
+
+import du
+import duviz
+import scanengine
+from bench_traversal import populate
+
+
+def best_time(function, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    cliparser = optparse.OptionParser('usage: %prog [options] [DIR]')
+    cliparser.add_option('--dirs',
+        action='store', type='int', dest='dirs', default=500,
+        help='number of directories in the synthetic tree (default: 500)', metavar='N')
+    cliparser.add_option('--files',
+        action='store', type='int', dest='files', default=40,
+        help='number of files per directory in the synthetic tree (default: 40)', metavar='N')
+    cliparser.add_option('-r', '--repeat',
+        action='store', type='int', dest='repeat', default=3,
+        help='number of rounds, best time is reported (default: 3)', metavar='N')
+    (clioptions, cliargs) = cliparser.parse_args()
+
+    duviz.getClusterSize()
+
+    tmp = None
+    if cliargs:
+        directory = cliargs[0]
+    else:
+        tmp = tempfile.mkdtemp()
+        directory = os.path.join(tmp, 'tree')
+        populate(directory, clioptions.dirs, clioptions.files, 100)
+        links = os.path.join(directory, 'links')
+        os.makedirs(links)
+        for i in range(clioptions.files):
+            os.link(os.path.join(directory, 'd00', 'sub00000', 'f%05d.dat' % i), os.path.join(links, 'l%05d' % i))
+
+    results = []
+    try:
+        names = sorted(scanengine.METRICS)
+        for n in range(1, len(names) + 1):
+            for metrics in itertools.combinations(names, n):
+                elapsed = best_time(lambda: scanengine.scan(directory, metrics), clioptions.repeat)
+                results.append(('engine ' + '+'.join(metrics), elapsed))
+        two_passes = best_time(lambda: (scanengine.scan(directory, ['bytes']), scanengine.scan(directory, ['inodes'])), clioptions.repeat)
+        results.append(('engine bytes, inodes (2 scans)', two_passes))
+        results.append(('duviz.build_du_tree ext table, files', best_time(
+            lambda: duviz.build_du_tree(directory, feedback=None, extensions=True, files=[]), clioptions.repeat)))
+        results.append(('du.iter_du_tree', best_time(lambda: list(du.iter_du_tree(directory)), clioptions.repeat)))
+        tree = scanengine.scan(directory, names)
+    finally:
+        if tmp:
+            shutil.rmtree(tmp)
+
+    print('%d folders, %d files, %d inodes' % (tree.folderCount + 1, tree.fileCount, tree.inodeCount))
+    for name, elapsed in results:
+        print('%-36s %8.3fs %10.0f files/s' % (name, elapsed, tree.fileCount / elapsed))
+
+
+if __name__ == '__main__':
+    main()
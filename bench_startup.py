@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+'''
+Startup time benchmark: run a duviz script on a small directory a number of
+times and report the wall clock time per run.
+
+The target is a median under 30ms per run for a small directory. The bare
+interpreter ("python -c pass") is timed as well for reference: it takes
+most of that (15 to 25ms, depending on the machine and installation).
+A script is compiled on every run, only imported modules are byte-code
+cached: that is why duviz.py is a small script importing duvizcore.py.
+With PYTHONDONTWRITEBYTECODE set, modules without an up to date .pyc file
+are compiled on every run as well (run "python -m compileall ." first),
+which adds another 20ms.
+Use "python -X importtime duviz.py" to see where import time goes.
+
+Exit status is 1 when the median run time is above the target.
+'''
+
+import optparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def make_small_tree(root):
+    for d in ['a', 'a/b', 'c']:
+        os.makedirs(os.path.join(root, d))
+    for i, d in enumerate(['', 'a', 'a/b', 'c']):
+        with open(os.path.join(root, d, 'file%d.txt' % i), 'w') as f:
+            f.write('x' * (100 * i))
+
+
+def time_runs(commands, runs, cwd=None):
+    '''
+    Run the commands in turn (so they share the ups and downs of the machine load).
+    @return sorted run times in milliseconds, per command
+    '''
+    timings = [[] for command in commands]
+    with open(os.devnull, 'w') as devnull:
+        for i in range(runs):
+            for command, times in zip(commands, timings):
+                start = time.perf_counter()
+                subprocess.check_call(command, stdout=devnull, stderr=devnull, cwd=cwd)
+                times.append((time.perf_counter() - start) * 1000.0)
+    return [sorted(times) for times in timings]
+
+
+def main():
+    cliparser = optparse.OptionParser('usage: %prog [options] [DIR]')
+    cliparser.add_option('-n', '--runs',
+        action='store', type='int', dest='runs', default=20,
+        help='number of runs (default: 20)', metavar='N')
+    cliparser.add_option('--target',
+        action='store', type='float', dest='target', default=30.0,
+        help='target median run time in milliseconds (default: 30)', metavar='MS')
+    cliparser.add_option('--script',
+        action='store', type='string', dest='script', default='duviz.py',
+        help='script to benchmark (default: duviz.py)', metavar='SCRIPT')
+    cliparser.add_option('-m', '--module',
+        action='store_true', dest='module', default=False,
+        help='run the script as module ("python -m duviz") instead')
+    (clioptions, cliargs) = cliparser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.join(here, clioptions.script)
+
+    tmp = None
+    if cliargs:
+        directory = cliargs[0]
+    else:
+        tmp = tempfile.mkdtemp()
+        directory = os.path.join(tmp, 'tree')
+        make_small_tree(directory)
+
+    try:
+        if clioptions.module:
+            command = [sys.executable, '-m', os.path.splitext(clioptions.script)[0], directory]
+        else:
+            command = [sys.executable, script, directory]
+        baseline, timings = time_runs([[sys.executable, '-c', 'pass'], command], clioptions.runs, cwd=here)
+    finally:
+        if tmp:
+            import shutil
+            shutil.rmtree(tmp)
+
+    median = timings[len(timings) // 2]
+    interpreter = baseline[len(baseline) // 2]
+    if os.environ.get('PYTHONDONTWRITEBYTECODE'):
+        print('note: PYTHONDONTWRITEBYTECODE is set, modules without an up to date .pyc are compiled on every run')
+    print('interpreter only: median %.1fms' % interpreter)
+    print('%s: min %.1fms, median %.1fms (+%.1fms), max %.1fms over %d runs' % (
+        clioptions.script, timings[0], median, median - interpreter, timings[-1], clioptions.runs))
+    if median > clioptions.target:
+        print('SLOW: median over %.0fms' % clioptions.target)
+        sys.exit(1)
+    print('OK: median under %.0fms' % clioptions.target)
+
+
+if __name__ == '__main__':
+    main()
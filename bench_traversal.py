@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+'''
+Traversal order benchmark: scan a tree in the default (directory listing)
+order and in inode order, and report the throughput of both.
+
+By default a synthetic tree is generated in a temporary folder. Pass a
+directory to benchmark an existing tree instead, e.g. a loop-mounted disk
+image on the spinning disk in question:
+
+    truncate -s 4G /hdd/bench.img && mkfs.ext4 -q /hdd/bench.img
+    mount -o loop /hdd/bench.img /mnt/bench && python bench_traversal.py --populate /mnt/bench
+
+The difference only shows with a cold cache: run as root with --drop-caches
+(Linux) to flush the page, dentry and inode caches before every scan.
+With a warm cache both orders measure only the Python overhead.
+'''
+
+import optparse
+import os
+import shutil
+import tempfile
+import time
+
+import du
+import duviz
+
+
+def populate(root, dirs, files_per_dir, file_size):
+    '''
+    Create a synthetic tree. Files are created round-robin over the
+    directories, so directory order and inode order do not coincide.
+    '''
+    paths = []
+    for i in range(dirs):
+        path = os.path.join(root, 'd%02d' % (i % 37), 'sub%05d' % i)
+        os.makedirs(path)
+        paths.append(path)
+    data = b'x' * file_size
+    for j in range(files_per_dir):
+        for path in paths:
+            with open(os.path.join(path, 'f%05d.dat' % j), 'wb') as f:
+                f.write(data)
+
+
+def drop_caches():
+    os.sync()
+    with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3\n')
+
+
+def run(name, scan, directory, cold):
+    if cold:
+        drop_caches()
+    start = time.perf_counter()
+    dirs, files = scan(directory)
+    elapsed = time.perf_counter() - start
+    return name, elapsed, dirs, files
+
+
+def scan_du(inode_order):
+    def scan(directory):
+        lines = du.build_du_tree(directory, inode_order)
+        return len(lines), sum(int(line.split('|', 1)[0]) for line in lines)
+    return scan
+
+
+def scan_duviz(inode_order):
+    def scan(directory):
+        tree = duviz.build_du_tree(directory, feedback=None, inode_order=inode_order)
+        return tree.folderCount + 1, tree.fileCount
+    return scan
+
+
+def main():
+    cliparser = optparse.OptionParser('usage: %prog [options] [DIR]')
+    cliparser.add_option('--dirs',
+        action='store', type='int', dest='dirs', default=500,
+        help='number of directories in the synthetic tree (default: 500)', metavar='N')
+    cliparser.add_option('--files',
+        action='store', type='int', dest='files', default=40,
+        help='number of files per directory in the synthetic tree (default: 40)', metavar='N')
+    cliparser.add_option('--file-size',
+        action='store', type='int', dest='file_size', default=0,
+        help='size of the synthetic files in bytes (default: 0)', metavar='BYTES')
+    cliparser.add_option('--populate',
+        action='store_true', dest='populate', default=False,
+        help='generate the synthetic tree inside DIR (e.g. a fresh loop mount)')
+    cliparser.add_option('--drop-caches',
+        action='store_true', dest='drop_caches', default=False,
+        help='drop the kernel caches before every scan (root only)')
+    cliparser.add_option('-r', '--repeat',
+        action='store', type='int', dest='repeat', default=3,
+        help='number of rounds, best time is reported (default: 3)', metavar='N')
+    (clioptions, cliargs) = cliparser.parse_args()
+
+    duviz.getClusterSize()
+
+    tmp = None
+    if cliargs:
+        directory = cliargs[0]
+        if clioptions.populate:
+            directory = os.path.join(directory, 'duviz-bench')
+            populate(directory, clioptions.dirs, clioptions.files, clioptions.file_size)
+    else:
+        tmp = tempfile.mkdtemp()
+        directory = os.path.join(tmp, 'tree')
+        populate(directory, clioptions.dirs, clioptions.files, clioptions.file_size)
+
+    scans = [
+        ('du.py default', scan_du(False)),
+        ('du.py inode-order', scan_du(True)),
+        ('duviz.py default', scan_duviz(False)),
+        ('duviz.py inode-order', scan_duviz(True)),
+    ]
+    best = {}
+    try:
+        for i in range(clioptions.repeat):
+            # Alternate the orders so cache effects do not favour one of them.
+            for name, scan in scans:
+                name, elapsed, dirs, files = run(name, scan, directory, clioptions.drop_caches)
+                if name not in best or elapsed < best[name][0]:
+                    best[name] = (elapsed, dirs, files)
+    finally:
+        if tmp:
+            shutil.rmtree(tmp)
+
+    print('cache: %s' % ('cold (dropped)' if clioptions.drop_caches else 'warm'))
+    for name, scan in scans:
+        elapsed, dirs, files = best[name]
+        print('%-22s %8.3fs %10.0f dirs/s %10.0f files/s' % (name, elapsed, dirs / elapsed, files / elapsed))
+    for tool in ['du.py', 'duviz.py']:
+        default = best[tool + ' default'][0]
+        inode = best[tool + ' inode-order'][0]
+        print('%s: inode order is %.2fx the speed of the default order' % (tool, default / inode))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+'''
+Duplicate file detection.
+
+Files are narrowed down in stages, so that only few files are read completely:
+ 1. group by size (free: the scanner already knows the sizes)
+ 2. drop hardlinks: keep one path per (device, inode)
+ 3. group by a hash of the first and last block
+ 4. group by a hash of the full content (mmap or large buffered reads)
+Stages 3 and 4 read the files in a thread pool.
+'''
+
+import collections
+import concurrent.futures
+import hashlib
+import mmap
+import os
+
+from scanengine import path_split
+
+BLOCK_SIZE = 1 << 14
+READ_SIZE = 1 << 20
+
+
+def _partial_hash(path, size):
+    h = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        h.update(f.read(BLOCK_SIZE))
+        if size > BLOCK_SIZE:
+            f.seek(max(BLOCK_SIZE, size - BLOCK_SIZE))
+            h.update(f.read(BLOCK_SIZE))
+    return h.digest()
+
+
+def _full_hash(path, size):
+    h = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                h.update(m)
+        except (ValueError, OSError):
+            # Not mappable (e.g. special file system): large buffered reads.
+            f.seek(0)
+            for chunk in iter(lambda: f.read(READ_SIZE), b''):
+                h.update(chunk)
+    return h.digest()
+
+
+def _safe(function):
+    def wrapper(item):
+        path, size = item
+        try:
+            return function(path, size)
+        except (IOError, OSError):
+            # Unreadable: give it a unique key so it never matches.
+            return ('error', path)
+    return wrapper
+
+
+def _regroup(groups, key_function, pool):
+    '''
+    Split every (size, paths) group on key_function(path, size) and
+    keep the sub groups with at least two members.
+    '''
+    items = [(path, size) for size, paths in groups for path in paths]
+    keys = pool.map(_safe(key_function), items)
+    result = collections.defaultdict(list)
+    for (path, size), key in zip(items, keys):
+        result[(size, key)].append(path)
+    return [(size, paths) for (size, key), paths in result.items() if len(paths) > 1]
+
+
+def find_duplicates(files, workers=4, min_size=1):
+    '''
+    Find files with identical content.
+
+    @param files iterable of (path, size) tuples
+    @param workers number of reader threads
+    @param min_size ignore files smaller than this
+    @return list of (size, paths) groups, paths sorted, one path per inode
+    '''
+    by_size = collections.defaultdict(list)
+    for path, size in files:
+        if size >= min_size:
+            by_size[size].append(path)
+
+    groups = []
+    for size, paths in by_size.items():
+        if len(paths) < 2:
+            continue
+        inodes = {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            inodes.setdefault((st.st_dev, st.st_ino), path)
+        if len(inodes) > 1:
+            groups.append((size, list(inodes.values())))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        groups = _regroup(groups, _partial_hash, pool)
+        # For small files the partial hash already covered the whole content.
+        small = [g for g in groups if g[0] <= 2 * BLOCK_SIZE]
+        large = [g for g in groups if g[0] > 2 * BLOCK_SIZE]
+        groups = small + _regroup(large, _full_hash, pool)
+
+    return sorted((size, sorted(paths)) for size, paths in groups)
+
+
+def reclaimable(groups):
+    '''Total bytes that would be freed by keeping only one file of each group.'''
+    return sum(size * (len(paths) - 1) for size, paths in groups)
+
+
+def apply_to_tree(tree, groups):
+    '''
+    Set the reclaimable bytes (dupSize, inclusive subnodes) on the nodes of a
+    DirectoryTreeNode tree. The first path of each group is considered the
+    original, all others are counted in their directory and its ancestors.
+    '''
+    for size, paths in groups:
+        for path in paths[1:]:
+            node = tree
+            node.dupSize += size
+            for component in path_split(os.path.dirname(path), base=tree.name)[1:]:
+                node = node._subnodes.get(component)
+                if node is None:
+                    break
+                node.dupSize += size
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+'''
+Distributed scanning: agents scan folders on their own host (du lines, see
+du.iter_du_tree) and send them over TCP to a coordinator, which merges the
+scans of all agents into one DirectoryTree under a synthetic root.
+
+    python distscan.py coordinator --listen 0.0.0.0:8737
+    python distscan.py agent --coordinator storage1:8737 --interval 3600 /data /home
+
+Transfers are deltas: a du line only holds the stats of the files in the
+folder itself, so on a rescan only the lines of changed folders (and the
+paths of removed folders) are sent, unchanged subtrees cost nothing.
+
+Protocol (text lines, UTF-8):
+
+    agent:       HELLO <name>|<root>|<base generation>
+    coordinator: SEND DELTA            (has the base generation of that scan)
+                 SEND FULL             (does not: send everything)
+    agent:       F|<du line>           (new or changed folder)
+                 D|<path>              (removed folder, delta only)
+                 END <new generation>
+    coordinator: OK <new generation>
+
+The coordinator applies a transfer only when it is complete (END), so an
+interrupted transfer leaves the previous state, and the agent sends its next
+delta against the generation acknowledged last.
+'''
+
+import os
+import socket
+import socketserver
+import sys
+import threading
+
+import du
+from DirectoryTree import DirectoryTree
+
+ENCODING = 'utf-8'
+ERRORS = 'surrogateescape'
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def parse_address(text, default_host='localhost'):
+    '''"host:port" or "port" -> (host, port)'''
+    host, _, port = text.rpartition(':')
+    return (host or default_host, int(port))
+
+
+def _send(f, line):
+    f.write(line.encode(ENCODING, ERRORS) + b'\n')
+
+
+def _receive(f):
+    line = f.readline()
+    if not line.endswith(b'\n'):
+        raise ProtocolError('connection closed')
+    return line[:-1].decode(ENCODING, ERRORS)
+
+
+class Agent(object):
+    '''
+    Scans a folder and pushes it to a coordinator.
+
+    @param coordinator (host, port) of the coordinator
+    @param root folder to scan
+    @param name name of this agent in the merged tree (default: host name)
+    '''
+
+    def __init__(self, coordinator, root, name=None, inode_order=False):
+        self.coordinator = coordinator
+        self.root = os.path.realpath(root)
+        self.name = name or socket.gethostname()
+        self.inode_order = inode_order
+        # State acknowledged by the coordinator: generation and {path: du line}
+        self.generation = 0
+        self.lines = {}
+
+    def scan(self):
+        '''@return {path: du line} of the current state of the folder'''
+        return dict((line.rsplit('|', 1)[-1], line) for line in du.iter_du_tree(self.root, self.inode_order))
+
+    def push(self, lines=None):
+        '''
+        Scan (unless lines are given) and send the changes since the last push.
+        @return (mode 'FULL' or 'DELTA', number of lines sent)
+        '''
+        if lines is None:
+            lines = self.scan()
+        sock = socket.create_connection(self.coordinator)
+        try:
+            f = sock.makefile('rwb')
+            _send(f, 'HELLO %s|%s|%d' % (self.name, self.root, self.generation))
+            f.flush()
+            reply = _receive(f)
+            if reply == 'SEND FULL':
+                changes = ['F|' + line for line in lines.values()]
+            elif reply == 'SEND DELTA':
+                changes = ['F|' + line for path, line in lines.items() if self.lines.get(path) != line]
+                changes.extend('D|' + path for path in self.lines if path not in lines)
+            else:
+                raise ProtocolError('unexpected reply: %r' % reply)
+            generation = self.generation + 1
+            for change in changes:
+                _send(f, change)
+            _send(f, 'END %d' % generation)
+            f.flush()
+            if _receive(f) != 'OK %d' % generation:
+                raise ProtocolError('transfer not acknowledged')
+            f.close()
+        finally:
+            sock.close()
+        self.generation = generation
+        self.lines = lines
+        return reply.split()[1], len(changes)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            hello = _receive(self.rfile)
+            if not hello.startswith('HELLO '):
+                raise ProtocolError('expected HELLO')
+            name, root, base = hello[len('HELLO '):].rsplit('|', 2)
+            key = (name, root)
+            full = not self.server.has_generation(key, int(base))
+            _send(self.wfile, 'SEND FULL' if full else 'SEND DELTA')
+            changed = []
+            removed = []
+            while True:
+                line = _receive(self.rfile)
+                if line.startswith('F|'):
+                    changed.append(line[2:])
+                elif line.startswith('D|'):
+                    removed.append(line[2:])
+                elif line.startswith('END '):
+                    generation = int(line[4:])
+                    break
+                else:
+                    raise ProtocolError('unexpected line: %r' % line)
+            self.server.apply(key, generation, full, changed, removed)
+            _send(self.wfile, 'OK %d' % generation)
+        except (ProtocolError, ValueError) as e:
+            sys.stderr.write('distscan: %s: %s\n' % (self.client_address[0], e))
+
+
+class Coordinator(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    '''
+    Receives the scans of the agents.
+
+    @param address (host, port) to listen on (port 0: any free port)
+    @param on_update called with the (name, root) key after every applied transfer
+    '''
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, on_update=None):
+        socketserver.TCPServer.__init__(self, address, _Handler)
+        self.on_update = on_update
+        self._lock = threading.Lock()
+        # (agent name, root) -> [generation, {path: du line}]
+        self.scans = {}
+
+    def has_generation(self, key, generation):
+        with self._lock:
+            return generation > 0 and key in self.scans and self.scans[key][0] == generation
+
+    def apply(self, key, generation, full, changed, removed):
+        with self._lock:
+            if full or key not in self.scans:
+                lines = {}
+            else:
+                lines = self.scans[key][1]
+            for line in changed:
+                lines[line.rsplit('|', 1)[-1]] = line
+            for path in removed:
+                lines.pop(path, None)
+            self.scans[key] = [generation, lines]
+        if self.on_update:
+            self.on_update(key)
+
+    def tree(self, name='all'):
+        '''
+        Merge all scans into one accumulated DirectoryTree: the root (named name)
+        has one subnode "<agent>:<root>" per scan.
+        '''
+        with self._lock:
+            scans = [(key, list(lines.values())) for key, (generation, lines) in self.scans.items()]
+        top = DirectoryTree(name)
+        for (agent, root), lines in sorted(scans):
+            sub = DirectoryTree(root)
+            for line in lines:
+                sub.AddFolder(line)
+            sub.name = '%s:%s' % (agent, root)
+            top.subnodes[sub.name] = sub
+        top.Accum()
+        return top
+
+
+def main():
+    import optparse
+    import time
+    cliparser = optparse.OptionParser('''usage: %prog coordinator [options]
+       %prog agent --coordinator HOST:PORT [options] DIRS''')
+    cliparser.add_option('--listen',
+        action='store', type='string', dest='listen', default='localhost:8737',
+        help='coordinator: address to listen on (default: %default)', metavar='HOST:PORT')
+    cliparser.add_option('--max-depth',
+        action='store', type='int', dest='max_depth', default=2,
+        help='coordinator: depth of the merged tree dump after every update (default: %default)', metavar='N')
+    cliparser.add_option('--coordinator',
+        action='store', type='string', dest='coordinator',
+        help='agent: address of the coordinator', metavar='HOST:PORT')
+    cliparser.add_option('--name',
+        action='store', type='string', dest='name',
+        help='agent: name in the merged tree (default: host name)')
+    cliparser.add_option('--interval',
+        action='store', type='float', dest='interval',
+        help='agent: rescan and send the changes every SECONDS (default: scan once)', metavar='SECONDS')
+    cliparser.add_option('--inode-order',
+        action='store_true', dest='inode_order', default=False,
+        help='agent: scan in inode order (faster on spinning disks)')
+    (clioptions, cliargs) = cliparser.parse_args()
+
+    if cliargs[:1] == ['coordinator']:
+        def show(key):
+            coordinator.tree().Dump(0, clioptions.max_depth)
+        coordinator = Coordinator(parse_address(clioptions.listen), on_update=show)
+        try:
+            coordinator.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            coordinator.server_close()
+    elif cliargs[:1] == ['agent'] and clioptions.coordinator and len(cliargs) > 1:
+        address = parse_address(clioptions.coordinator)
+        agents = [Agent(address, d, clioptions.name, clioptions.inode_order) for d in cliargs[1:]]
+        while True:
+            for agent in agents:
+                try:
+                    mode, sent = agent.push()
+                    sys.stderr.write('%s: sent %s, %d lines\n' % (agent.root, mode.lower(), sent))
+                except (OSError, ProtocolError) as e:
+                    sys.stderr.write('%s: %s\n' % (agent.root, e))
+            if not clioptions.interval:
+                break
+            time.sleep(clioptions.interval)
+    else:
+        cliparser.error('specify "coordinator" or "agent --coordinator HOST:PORT DIRS"')
+
+
+if __name__ == '__main__':
+    main()
@@ -5,89 +5,224 @@
 #
 
 import os
-import platform
-import optparse
-import ctypes
-import math
+import sys
+import time
+
+from sizehist import SizeHistogram
+from scanengine import getClusterSize, AllocatedSize, walk
 
 # -a allocated size
 # -r recursive
 # 
 
-# For Windows: determine the cluster size for allocated file size
-def getClusterSize():
-    global gClusterSize 
-    gClusterSize = None
-
-    if (platform.system() == 'Windows'):
-        sectorsPerCluster = ctypes.c_ulonglong(0)
-        bytesPerSector = ctypes.c_ulonglong(0)
-        rootPathName = ctypes.c_wchar_p(u"c:\\") # TODO change to drive being scanned!
-        ctypes.windll.kernel32.GetDiskFreeSpaceW(rootPathName,ctypes.pointer(sectorsPerCluster),ctypes.pointer(bytesPerSector),None,None)
-        gClusterSize = (int)(sectorsPerCluster.value) * (int)(bytesPerSector.value)
-
-def AllocatedSize(size):
-    if (gClusterSize != None):
-        return math.ceil(size/gClusterSize) * gClusterSize
-    return size
-
-def build_du_tree(folder):
+def folder_line(root, files):
+    '''
+    Summarize the files of one folder.
+    @param files list of (file name, stat result), see scanengine.walk
+    @return du line: count|size|alloc|largeFN|largeF_Size|oldFN|oldF_Date|sizeHist|path
+    '''
+    largeF = ('',0)
+    oldCF = oldMF = ('','') # no files: no oldest date (not the epoch)
+    sizeHist = SizeHistogram()
+    rootFileSize = 0
+    rootAllocSize = 0
+    rootFileCount = len(files)
+
+    if (rootFileCount > 0): # 'max' falls over if tuples is empty
+        filesizes = []
+        allocsizes = []
+        fileAccess = []
+        fileCreate = []
+        fileMod = []
+        for name, aStat in files:
+            aSize = aStat.st_size
+            # aSize = os.path.getsize(os.path.join(root,name))
+            filesizes.append(aSize)
+            sizeHist.add(aSize)
+            allocsizes.append(AllocatedSize(aSize))
+            fileAccess.append(aStat.st_atime)
+            fileCreate.append(aStat.st_ctime)
+            fileMod.append(aStat.st_mtime)
+
+        rootFileSize = sum(filesizes)
+        rootAllocSize = sum(allocsizes)
+
+        names = [name for name, aStat in files]
+        sizeTup = list(zip(names, filesizes))
+        createTup = list(zip(names, fileCreate))
+        accessTup = list(zip(names, fileAccess))
+        modTup = list(zip(names, fileMod))
+        largeF = max(sizeTup, key=lambda x:x[1])
+        oldCF = min(createTup, key=lambda x:x[1])
+        oldAF = min(accessTup, key=lambda x:x[1])
+        oldMF = min(modTup, key=lambda x:x[1])
+
+    # Windows HACK: on copying files, the 'create' date can be AFTER the 'modify' date
+    oldF = oldCF[0]
+    oldFD = oldCF[1]
+    if (oldMF[1] < oldCF[1]):
+        oldF = oldMF[0]
+        oldFD = oldMF[1]
+
+    # TODO drive which columns appear based on options
+    # count|size|alloc|largeFN|largeF_Size|oldFN|oldF_Date|sizeHist|path
+    return '{1}|{2}|{5}|{3}|{4}|{6}|{7}|{8}|{0}'.format(root, rootFileCount, rootFileSize, largeF[0], largeF[1], rootAllocSize, oldF, oldFD, sizeHist.encode())
+
+class Journal(object):
+    '''
+    Checkpoint journal of a scan, so that an interrupted scan can be resumed.
+    Text file with one entry per line:
+        F|<du line>   a folder has been scanned (see folder_line)
+        C|<path>      the folder and its complete subtree have been scanned
+    Entries are buffered and written (and fsync'ed) in batches.
+    '''
+
+    def __init__(self, path, batch=1000, interval=5.0):
+        self.path = path
+        self.batch = batch
+        self.interval = interval
+        self._buffer = []
+        self._last_flush = time.time()
+        self._file = None
+        self._end = None # size of the complete entries found by load()
+
+    def load(self):
+        '''
+        Read an existing journal.
+        @return (dict path -> du line, set of completed subtree paths)
+        '''
+        records = {}
+        complete = set()
+        self._end = 0
+        if not os.path.exists(self.path):
+            return records, complete
+        with open(self.path, 'rb') as f:
+            for entry in f:
+                if not entry.endswith(b'\n'):
+                    break # torn write at the end of an interrupted scan
+                self._end += len(entry)
+                kind, _, data = entry[:-1].decode('utf-8', 'surrogateescape').partition('|')
+                if kind == 'F':
+                    records[data.rsplit('|', 1)[-1]] = data
+                elif kind == 'C':
+                    complete.add(data)
+        return records, complete
+
+    def open(self, append):
+        '''
+        Open the journal for writing.
+        @param append: keep the existing entries; after load(), a torn entry at the end is cut off first
+        '''
+        if append and self._end is not None and os.path.exists(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(self._end)
+        self._file = open(self.path, 'a' if append else 'w', encoding='utf-8', errors='surrogateescape')
+
+    def folder(self, line):
+        self._add('F|' + line)
+
+    def complete(self, path):
+        self._add('C|' + path)
+
+    def _add(self, entry):
+        self._buffer.append(entry + '\n')
+        if len(self._buffer) >= self.batch or time.time() - self._last_flush > self.interval:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write(''.join(self._buffer))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._buffer = []
+        self._last_flush = time.time()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+def iter_du_tree(folder, inode_order=False, checkpoint=None, resume=False):
+    '''
+    Scan folder, yielding the du line of every directory (see folder_line) as soon as it is scanned.
+    @param inode_order: walk the tree in inode order (see scanengine.walk)
+    @param checkpoint: path of a Journal file to record the progress in
+    @param resume: continue the scan recorded in the checkpoint journal:
+        completed subtrees are not visited again. Folders recorded as scanned but not
+        completed are listed again (to find their subfolders), their lines come from
+        the journal, first.
+    '''
     getClusterSize() # TODO undefined if called by other module; need to split out into controller function
-    lines = []
     folder = os.path.realpath(folder) # TODO is this necessary?
-    for root, dirs, files in os.walk(folder):
-        largeF = ('',0)
-        rootFileSize = 0
-        rootAllocSize = 0
-        rootFileCount = len(files)
-
-        if (rootFileCount > 0): # 'max' falls over if tuples is empty
-            filesizes = []
-            allocsizes = []
-            fileAccess = []
-            fileCreate = []
-            fileMod = []
-            for name in files:
-                aStat = os.stat(os.path.join(root,name))
-                aSize = aStat.st_size
-                # aSize = os.path.getsize(os.path.join(root,name))
-                filesizes.append(aSize)
-                allocsizes.append(AllocatedSize(aSize))
-                fileAccess.append(aStat.st_atime)
-                fileCreate.append(aStat.st_ctime)
-                fileMod.append(aStat.st_mtime)
-
-            rootFileSize = sum(filesizes)
-            rootAllocSize = sum(allocsizes)
-
-            sizeTup = list(zip(files, filesizes))
-            createTup = list(zip(files, fileCreate))
-            accessTup = list(zip(files, fileAccess))
-            modTup = list(zip(files, fileMod))
-            largeF = max(sizeTup, key=lambda x:x[1])
-            oldCF = min(createTup, key=lambda x:x[1])
-            oldAF = min(accessTup, key=lambda x:x[1])
-            oldMF = min(modTup, key=lambda x:x[1])
-
-        # Windows HACK: on copying files, the 'create' date can be AFTER the 'modify' date
-        oldF = oldCF[0]
-        oldFD = oldCF[1]
-        if (oldMF[1] < oldCF[1]):
-            oldF = oldMF[0]
-            oldFD = oldMF[1]
-
-        # TODO drive which columns appear based on options
-        # count|size|alloc|largeFN|largeF_Size|oldFN|oldF_Date|path
-        lines.append('{1}|{2}|{5}|{3}|{4}|{6}|{7}|{0}'.format(root, rootFileCount, rootFileSize, largeF[0], largeF[1], rootAllocSize, oldF, oldFD))
-        (lines.append(subline) for subline in (build_du_tree(dir) for dir in dirs))
-    return lines
+    if checkpoint is None:
+        for root, dirs, files in walk(folder, inode_order):
+            yield folder_line(root, files)
+        return
+
+    journal = Journal(checkpoint)
+    records, complete = journal.load() if resume else ({}, set())
+    for line in records.values():
+        yield line
+    if folder in complete:
+        return
+    journal.open(append=resume)
+
+    # Number of subdirectories still to be completed, per open folder
+    pending = {}
+
+    def completed(path):
+        while True:
+            journal.complete(path)
+            if path == folder:
+                return
+            path = os.path.dirname(path)
+            pending[path] -= 1
+            if pending[path] > 0:
+                return
+            del pending[path]
+
+    def onerror(error):
+        # Unreadable folders are not yielded by the walk: count them as done.
+        if error.filename != folder:
+            completed(error.filename)
+
+    try:
+        for root, dirs, files in walk(folder, inode_order, onerror=onerror):
+            dirs[:] = [d for d in dirs if os.path.join(root, d) not in complete]
+            if root not in records:
+                line = folder_line(root, files)
+                journal.folder(line)
+                yield line
+            if dirs:
+                pending[root] = len(dirs)
+            else:
+                completed(root)
+    finally:
+        journal.close()
+
+def build_du_tree(folder, inode_order=False, checkpoint=None, resume=False):
+    '''
+    Scan folder, one du line per directory: iter_du_tree() as a list.
+    '''
+    return list(iter_du_tree(folder, inode_order, checkpoint, resume))
 
 def main():
+    import optparse
 
     getClusterSize()
 
     argP = optparse.OptionParser('usage: %prog [options] [DIR]', version='%prog 1.0')
+    argP.add_option('--inode-order',
+        action='store_true', dest='inode_order', default=False,
+        help='scan in inode order (faster on spinning disks)')
+    argP.add_option('--checkpoint',
+        action='store', type='string', dest='checkpoint', default=None,
+        help='record the scan progress in FILE', metavar='FILE')
+    argP.add_option('--resume',
+        action='store_true', dest='resume', default=False,
+        help='resume the interrupted scan recorded in the --checkpoint file')
     (argO, argA) = argP.parse_args()
+    if argO.resume and not argO.checkpoint:
+        argP.error('--resume requires --checkpoint')
     paths = ['.']  # Do current dir if no dirs are given.
     if len(argA) > 0:
         paths = []
@@ -98,7 +233,7 @@ def main():
                 sys.stderr.write('Warning: not a valid path: "%s"\n' % path)
 
     for directory in paths:
-        lines = build_du_tree(directory)
+        lines = build_du_tree(directory, argO.inode_order, argO.checkpoint, argO.resume)
         for line in lines:
             print(line)
         print(len(lines))
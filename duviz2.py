@@ -1,22 +1,95 @@
-import optparse
 import os
+import sys
 
 from terminalsize import get_terminal_size
-from du import build_du_tree
+from du import build_du_tree, iter_du_tree
 from DirectoryTree import DirectoryTree
 
 # TODO push into terminalsize.py ?
 def getTerminalSize():
     global terminal_width
-    os.system("mode con lines=40 cols=130")  # TODO hack for debugging
     terminal_width, ignore  = get_terminal_size()
     terminal_width -= 1 # seems to be necessary on windows? \r vs \r\n ?
 
+# Option defaults, also used without optparse when only directories are given
+CLI_DEFAULTS = {
+    'show_hist': False,
+    'inode_order': False,
+    'checkpoint': None,
+    'resume': False,
+    'memory_budget': None,
+    'queries': None,
+    'history': None,
+    'growth': None,
+    'growth_top': 20,
+}
+
+class CliOptions(object):
+    def __init__(self, **options):
+        self.__dict__.update(options)
+
+def parse_cli(args):
+    if not any(arg.startswith('-') for arg in args):
+        return CliOptions(**CLI_DEFAULTS), list(args)
+
+    import optparse
+    argP = optparse.OptionParser('''usage: %prog [options] [DIRS]''', version='%prog 1.0')
+    argP.add_option('--histogram',
+        action='store_true', dest='show_hist',
+        help='show a log2 file size histogram per directory')
+    argP.add_option('--inode-order',
+        action='store_true', dest='inode_order',
+        help='scan in inode order (faster on spinning disks)')
+    argP.add_option('--checkpoint',
+        action='store', type='string', dest='checkpoint',
+        help='record the scan progress in FILE', metavar='FILE')
+    argP.add_option('--resume',
+        action='store_true', dest='resume',
+        help='resume the interrupted scan recorded in the --checkpoint file')
+    argP.add_option('--memory-budget',
+        action='store', type='int', dest='memory_budget',
+        help='keep at most N folder records in memory, spill the rest to temporary files', metavar='N')
+    argP.add_option('--query',
+        action='append', type='string', dest='queries',
+        help='list folders instead of the tree dump: "size>100G", "size<1M", "top=10" or "path=DIR"', metavar='QUERY')
+    argP.add_option('--history',
+        action='store', type='string', dest='history',
+        help='append the folder totals of the scan to the SQLite database DB (only the changed ones)', metavar='DB')
+    argP.add_option('--growth',
+        action='store', type='float', dest='growth',
+        help='instead of scanning, report the fastest growing folders of the last DAYS days from the --history database', metavar='DAYS')
+    argP.add_option('--growth-top',
+        action='store', type='int', dest='growth_top',
+        help='number of folders in the --growth report (default: 20)', metavar='N')
+    argP.set_defaults(**CLI_DEFAULTS)
+    (argO, argA) = argP.parse_args(args)
+    if argO.resume and not argO.checkpoint:
+        argP.error('--resume requires --checkpoint')
+    if argO.queries and argO.memory_budget:
+        argP.error('--query needs the full tree, it can not be combined with --memory-budget')
+    if argO.history and argO.memory_budget:
+        argP.error('--history needs the full tree, it can not be combined with --memory-budget')
+    if argO.growth and not argO.history:
+        argP.error('--growth requires --history')
+    return argO, argA
+
+def print_queries(dir_tree, queries):
+    import treequery
+    index = treequery.TreeIndex(dir_tree)
+    for query in queries:
+        try:
+            results = index.query(query)
+        except (ValueError, KeyError) as e:
+            sys.stderr.write('Warning: query {0}: {1}\n'.format(query, e))
+            continue
+        print('Query: {0} ({1} folders)'.format(query, len(results)))
+        for line in treequery.format_results(results, str):
+            print(line)
+
 def main():
     getTerminalSize()
 
-    argP = optparse.OptionParser('''usage: %prog [options] [DIRS]''', version='%prog 1.0')
-    (argO, argA) = argP.parse_args()
+    (argO, argA) = parse_cli(sys.argv[1:])
 
     # TODO push into a utility file
     paths = ['.']  # Do current dir if no dirs are given.
@@ -28,15 +101,46 @@ def main():
             else:
                 sys.stderr.write('Warning: not a valid path: "%s"\n' % path)
 
+    if argO.growth:
+        import history
+        import time
+        db = history.History(argO.history)
+        for directory in paths:
+            rows = db.growth(os.path.realpath(directory), time.time() - argO.growth * 86400, argO.growth_top)
+            print('Growth over {0:g} days: {1}'.format(argO.growth, os.path.realpath(directory)))
+            for line in history.growth_report(rows, argO.growth):
+                print(line)
+        db.close()
+        return
+
     for directory in paths:
-        lines = build_du_tree(directory)
-        dir_tree = DirectoryTree(directory)
+        if argO.memory_budget:
+            import spilltree
+            # Streamed: the lines are not collected, with or without a checkpoint journal
+            lines = iter_du_tree(directory, argO.inode_order, argO.checkpoint, argO.resume)
+            dir_tree = spilltree.build_tree_spilled(lines, os.path.realpath(directory), argO.memory_budget, maxlevel=1)
+            print(dir_tree.totFold)
+            dir_tree.Dump(0,1,argO.show_hist)
+            continue
+
+        lines = build_du_tree(directory, argO.inode_order, argO.checkpoint, argO.resume)
+        dir_tree = DirectoryTree(os.path.realpath(directory))
         for line in lines:
             dir_tree.AddFolder(line)
         dir_tree.Accum()
 
+        if argO.history:
+            import history
+            db = history.History(argO.history)
+            db.record(dir_tree, dir_tree.name)
+            db.close()
+
+        if argO.queries:
+            print_queries(dir_tree, argO.queries)
+            continue
+
         print(len(lines))
-        dir_tree.Dump(0,1)
+        dir_tree.Dump(0,1,argO.show_hist)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,896 @@
+##############################################################################
+# Copyright 2009-2013 Stefaan Lippens
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+##############################################################################
+
+'''
+Command line tool for visualization of the disk space usage of a directory
+and its subdirectories: the implementation of duviz.py (see there), as a
+module so that it is byte-code cached.
+
+Copyright: 2009-2013 Stefaan Lippens
+Website: http://soxofaan.github.io/duviz/
+'''
+
+import os
+import sys
+
+from terminalsize import get_terminal_size
+from sizehist import SizeHistogram
+from scanengine import path_split, getClusterSize, AllocatedSize
+
+##############################################################################
+def bar(width, label, fill='-', left='[', right=']', one='|'):
+    '''
+    Helper function to render bar strings of certain width with a label.
+
+    @param width the desired total width
+    @param label the label to be rendered (will be clipped if too long).
+    @param fill the fill character to fill empty space
+    @param left the symbol to use at the left of the bar
+    @param right the symbol to use at the right of the bar
+    @param one the character to use when the bar should be only one character wide
+
+    @return rendered string
+    '''
+    if width >= 2:
+        label_width = width - len(left) - len(right)
+        return left + label[:label_width].center(label_width, fill) + right
+    elif width == 1:
+        return one
+    else:
+        return ''
+
+
+##############################################################################
+def _human_readable_size(size, base, formats):
+    '''Helper function to render counts and sizes in a easily readable format.'''
+    for f in formats[:-1]:
+        if round(size, 2) < base:
+            return f % size
+        size = float(size) / base
+    return formats[-1] % size
+
+
+def human_readable_byte_size(size, binary=True):
+    '''Return byte size as 11B, 12.34KB or 345.24MB (or binary: 12.34KiB, 345.24MiB).'''
+    if binary:
+        return _human_readable_size(size, 1024, ['%dB', '%.2fKiB', '%.2fMiB', '%.2fGiB', '%.2fTiB'])
+    else:
+        return _human_readable_size(size, 1000, ['%dB', '%.2fKB', '%.2fMB', '%.2fGB', '%.2fTB'])
+
+
+def human_readable_count(count):
+    '''Return inode count as 11, 12.34k or 345.24M.'''
+    return _human_readable_size(count, 1000, ['%d', '%.2fk', '%.2fM', '%.2fG', '%.2fT'])
+
+
+def format_date(timestamp):
+    '''Return a file time stamp as 2013-05-17 10:43.'''
+    import time
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp))
+
+
+##############################################################################
+def file_extension(filename):
+    '''
+    Lower case extension of a file name including the dot ('' if there is none),
+    interned so all nodes share one string object per extension.
+    '''
+    return sys.intern(os.path.splitext(filename)[1].lower())
+
+
+class ExtensionTable(object):
+    '''
+    Aggregation table of file counts and bytes per file extension,
+    or per (extension, owner uid) pair when owners are tracked too.
+    '''
+
+    def __init__(self):
+        # key -> [count, bytes]
+        self.rows = {}
+
+    def add(self, key, size):
+        row = self.rows.get(key)
+        if row is None:
+            self.rows[key] = [1, size]
+        else:
+            row[0] += 1
+            row[1] += size
+
+    def merge(self, other):
+        rows = self.rows
+        for key, (count, size) in other.rows.items():
+            row = rows.get(key)
+            if row is None:
+                rows[key] = [count, size]
+            else:
+                row[0] += count
+                row[1] += size
+
+    def sorted_rows(self, top=None):
+        '''
+        @return list of (key, count, bytes), largest bytes first.
+        '''
+        rows = sorted(((k, c, b) for k, (c, b) in self.rows.items()), key=lambda r: (-r[2], r[0]))
+        if top:
+            rows = rows[:top]
+        return rows
+
+    def report(self, top=None, size_renderer=human_readable_byte_size):
+        '''
+        Render the table as lines of the form "<bytes> <count> <extension> [uid]".
+        '''
+        lines = []
+        for key, count, size in self.sorted_rows(top):
+            if isinstance(key, tuple):
+                label = '{0} uid={1}'.format(key[0] or '(none)', key[1])
+            else:
+                label = key or '(none)'
+            lines.append('{0:>10} {1:>8} {2}'.format(size_renderer(size), human_readable_count(count), label))
+        return lines
+
+
+##############################################################################
+class DirectoryTreeNode(object):
+    '''
+    Node in a directory tree, holds the name of the node, its size (including
+    subdirectories) and the subdirectories.
+    '''
+
+    def __init__(self, path):
+        # Name of the node. For root node: path up to root node as given, for subnodes: just the folder name
+        self.name = path
+
+        # Total size of node.
+        # By default this is assumed to be total node size, inclusive sub nodes,
+        # otherwise recalculate_own_sizes_to_total_sizes() should be called.
+        self.size = 0   # inclusive
+        self.mySize = 0 # non-inclusive
+        self.myAllocSize = 0 # non-inclusive
+        self.allocSize = 0   # inclusive
+
+        # TODO file information should go in separate class(es)
+        self.fileCount = 0
+        self.myFileCount = 0
+        self.largestFileSize = 0
+        self.largestFileName = ''
+        self.myLargestFileSize = 0
+        self.myLargestFileName = ''
+
+        # Filled in by the inodes and ages metrics of scanengine.scan()
+        self.inodeCount = 0
+        self.myInodeCount = 0
+        self.oldestFileDate = 0
+        self.oldestFileName = ''
+        self.myOldestFileDate = 0
+        self.myOldestFileName = ''
+
+        # log2 file size histogram (inclusive sub nodes)
+        self.sizeHist = SizeHistogram()
+
+        # Per extension table of the files in this node only (None: not tracked)
+        self.extTable = None
+
+        # Bytes reclaimable by removing duplicate files (inclusive sub nodes), see dedup.py
+        self.dupSize = 0
+
+        # Number of folders below this node (inclusive folded ones)
+        self.folderCount = 0
+        # True if (some of) the folders below were folded into this node's totals
+        # instead of being kept as subnodes (see build_du_tree fold options)
+        self.collapsed = False
+        # True if (some of) the folders below could not be scanned (see stallguard.py),
+        # the totals are a lower bound then
+        self.incomplete = False
+
+        # Dictionary of subnodes
+        self._subnodes = {}
+
+    def import_path(self, path, size):
+        '''
+        Import directory tree data
+        @param path Path object: list of path directory components.
+        @param size total size of the path in bytes.
+        '''
+        # Get relative path
+        path = path_split(path, base=self.name)[1:]
+        # Walk down path and create subnodes if required.
+        cursor = self
+        for component in path:
+            if component not in cursor._subnodes:
+                cursor._subnodes[component] = DirectoryTreeNode(component)
+            cursor = cursor._subnodes[component]
+
+        # Set size at cursor
+        assert cursor.size == 0
+        cursor.size = size
+        cursor.mySize = size
+        cursor.allocSize = AllocatedSize(size)
+        cursor.myAllocSize = AllocatedSize(size)
+
+        return cursor
+
+    def AddFile(self, filename, filesize):
+        '''
+        Add a file to this node.
+        @param filename: the name of the file to add
+        @param size: size of the file in bytes.
+        '''
+        self.size += filesize   # accumulated file sizes
+        self.mySize += filesize # my file sizes
+        self.allocSize += AllocatedSize(filesize)
+        self.myAllocSize += AllocatedSize(filesize)
+
+        self.fileCount += 1
+        self.myFileCount += 1
+        self.sizeHist.add(filesize)
+
+        # track largest file in folder
+        if (filesize > self.myLargestFileSize):
+            self.myLargestFileSize = filesize
+            self.myLargestFileName = filename
+        if (filesize > self.largestFileSize):
+            self.largestFileSize = filesize
+            self.largestFileName = filename
+
+    def AddDir(self, sub_tree):
+        self.size += sub_tree.size      # add sub-node size to self
+        self.allocSize += sub_tree.allocSize
+        self.folderCount += sub_tree.folderCount + 1
+        if sub_tree.incomplete:
+            self.incomplete = True
+        
+        # accumulated file counts
+        self.fileCount += sub_tree.fileCount
+        self.sizeHist.merge(sub_tree.sizeHist)
+
+        # accumulated largest file
+        if (sub_tree.largestFileSize > self.largestFileSize):
+            self.largestFileSize = sub_tree.largestFileSize
+            self.largestFileName = sub_tree.largestFileName
+
+    def ext_table(self):
+        '''
+        Extension table of this node and all its subnodes.
+
+        @return ExtensionTable, or None if extensions were not tracked during the scan
+        '''
+        if self.extTable is None:
+            return None
+        table = ExtensionTable()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.extTable is not None:
+                table.merge(node.extTable)
+            stack.extend(node._subnodes.values())
+        return table
+
+    def collapse(self):
+        '''
+        Drop the subnodes, keeping their data only in this node's totals.
+        '''
+        if self.extTable is not None:
+            self.extTable = self.ext_table()
+        if self._subnodes:
+            self._subnodes = {}
+            self.collapsed = True
+
+    def recalculate_own_sizes_to_total_sizes(self):
+        '''
+        If provided sizes were own sizes instead of total node sizes.
+
+        @return (recalculated) total size of node
+        '''
+        self.size = self.size + sum([n.recalculate_own_sizes_to_total_sizes() for n in self._subnodes.values()])
+        return self.size
+
+    def __cmp__(self, other):
+        return - cmp(self.size, other.size)
+
+    def __repr__(self):
+        return '[%s(%d):%s]' % (self.name, self.size, repr(self._subnodes))
+
+    def block_display(self, width, max_depth=5, top=True, size_renderer=human_readable_byte_size, index=None, path=None):
+        '''
+        Block display, subfolders side by side, largest first.
+
+        @param index treequery.TreeIndex over (a tree containing) this folder:
+            the subfolders come in its presorted order instead of being sorted here
+        @param path path of this folder in the index (default: its name)
+        '''
+        if width < 1 or max_depth < 0:
+            return ''
+
+        lines = []
+
+        if top:
+            lines.append('_' * width)
+
+        # Display of current dir.
+        lines.append(bar(width, self.name, fill=' '))
+        lines.append(bar(width, size_renderer(self.allocSize), fill=' '))
+        lines.append(bar(width, size_renderer(self.size), fill='_'))
+
+        # Display of subdirectories.
+        if index is None:
+            subdirs = sorted(((None, sd) for sd in self._subnodes.values()), key=lambda item: item[1].size, reverse=True)
+        else:
+            subdirs = index.subfolders(path or self.name)
+        if len(subdirs) > 0:
+            # Generate block display.
+            subdir_blocks = []
+            cumsize = 0
+            currpos = 0
+            lastpos = 0
+            for sd_path, sd in subdirs:
+                cumsize += sd.size
+                currpos = int(float(width * cumsize) / self.size) if self.size else 0
+                subdir_blocks.append(sd.block_display(currpos - lastpos, max_depth - 1, top=False, size_renderer=size_renderer,
+                                                      index=index, path=sd_path).split('\n'))
+                lastpos = currpos
+            # Assemble blocks.
+            height = max([len(lns) for lns in subdir_blocks])
+            for i in range(height):
+                line = ''
+                for sdb in subdir_blocks:
+                    if i < len(sdb):
+                        line += sdb[i]
+                    elif len(sdb) > 0:
+                        line += ' ' * len(sdb[0])
+                lines.append(line.ljust(width))
+
+        return '\n'.join(lines)
+
+    def size_render(self, size_renderer=human_readable_byte_size):
+        return "{} ({}):".format(size_renderer(self.size), size_renderer(self.allocSize))
+
+    def oldest_render(self):
+        if not self.oldestFileName:
+            return ''
+        return "{}({})".format(self.oldestFileName, format_date(self.oldestFileDate))
+
+    def display_name(self):
+        return self.name + ' (incomplete)' if self.incomplete else self.name
+
+    # Tree display of the form:
+    # +<size> (<alloc-size>): <foldername>
+    #       Counts: ...
+    # |
+    # `-<size> (<alloc-size>): <subfoldername>
+    #         Counts: ...
+    #    |
+    #    `-<size> (<alloc-size>): <subsubfoldername>
+    def tree_display(self, size_renderer=human_readable_byte_size, show_hist=False, show_dupes=False, show_inodes=False, show_ages=False,
+                     max_depth=1, threshold=0, index=None, path=None):
+        '''Tree display as a string, see write_tree_display().'''
+        import io
+        out = io.StringIO()
+        self.write_tree_display(out, size_renderer, show_hist, show_dupes, show_inodes, show_ages, max_depth, threshold,
+                                index=index, path=path)
+        return out.getvalue().rstrip('\n')
+
+    def write_tree_display(self, out, size_renderer=human_readable_byte_size, show_hist=False, show_dupes=False, show_inodes=False,
+                           show_ages=False, max_depth=1, threshold=0, buffer_nodes=1000, index=None, path=None):
+        '''
+        Write the tree display to a text stream while walking the tree,
+        in chunks of buffer_nodes folders. Subfolders come largest first.
+
+        @param max_depth number of subfolder levels to show (None: all)
+        @param threshold leave out (without visiting or formatting them) the
+            subfolders smaller than this percentage of their parent folder
+        @param index treequery.TreeIndex over (a tree containing) this folder:
+            the subfolders come in its presorted order instead of being sorted
+            here, e.g. for repeated displays of the same tree
+        @param path path of this folder in the index (default: its name)
+        '''
+        # Totals only grow towards the root: the size column fits the widest rendering up to the root sizes
+        size_wide = probe_width(size_renderer, self.size or 0) + probe_width(size_renderer, self.allocSize or 0) + len(' ():')
+        detail_wide = size_wide + 2
+
+        # Below a subfolder line, its lines and those of its subfolders get the same prefix:
+        # the one of the subfolder line plus its own "|" while subfolders after it follow.
+        # That prefix is 3 characters longer, the labels stay aligned on the sizes.
+        sub_detail_wide = detail_wide - 3
+
+        # One format() per folder: {0} prefix, {1} sizes, {2} name, {3},{4} counts, {5}({6}) largest file,
+        # {7} prefix of the lines below
+        details = '\n{7}%s {3},{4}\n{7}%s {5}({6})'
+        top_block = '+{1:>%d} {2}' % size_wide + details % ('Counts:'.rjust(detail_wide), 'Larges:'.rjust(detail_wide))
+        block = '{0}|\n{0}`-{1:>%d} {2}' % size_wide + details % ('Counts:'.rjust(sub_detail_wide), 'Larges:'.rjust(sub_detail_wide))
+        pruned_block = '{0}|\n{0}`-' + ' ' * size_wide + ' ({1} {2} below %g%%)' % threshold
+        extras = show_hist or show_dupes or show_inodes or show_ages
+        chunk = []
+
+        # Depth first, without recursion: stack of (node, depth, prefix of its lines, is last subfolder, index path).
+        # (None, count, prefix, True, None) stands for the count subfolders left out below the threshold.
+        stack = [(self, 0, '', True, path or self.name)]
+        while stack:
+            if len(chunk) >= buffer_nodes:
+                out.write('\n'.join(chunk) + '\n')
+                chunk = []
+            node, depth, prefix, last, node_path = stack.pop()
+            if node is None:
+                chunk.append(pruned_block.format(prefix, depth, 'folder' if depth == 1 else 'folders'))
+                continue
+
+            if depth > 0:
+                below = prefix + ('   ' if last else '|  ')
+                wide = sub_detail_wide
+            else:
+                below = prefix
+                wide = detail_wide
+            size_text = size_renderer(node.size)
+            alloc_text = size_text if node.allocSize == node.size else size_renderer(node.allocSize)
+            chunk.append((block if depth else top_block).format(
+                prefix, '%s (%s):' % (size_text, alloc_text), node.display_name(),
+                node.myFileCount, node.fileCount, node.largestFileName, size_renderer(node.largestFileSize), below))
+            if extras:
+                if show_hist:
+                    chunk.append(below + '{0:>{wide}} {1}'.format('Sizes:', node.sizeHist.render(size_renderer), wide=wide))
+                if show_dupes:
+                    chunk.append(below + '{0:>{wide}} {1}'.format('Dupes:', size_renderer(node.dupSize), wide=wide))
+                if show_inodes:
+                    chunk.append(below + '{0:>{wide}} {1},{2}'.format('Inodes:', node.myInodeCount, node.inodeCount, wide=wide))
+                if show_ages:
+                    chunk.append(below + '{0:>{wide}} {1}'.format('Oldest:', node.oldest_render(), wide=wide))
+
+            if max_depth is not None and depth >= max_depth:
+                continue
+            # [(index path, subfolder)], largest first
+            minimum = (node.size or 0) * threshold / 100.0
+            if index is None:
+                # Prune before sorting, so only the shown subfolders are sorted
+                subdirs = [(None, sd) for sd in node._subnodes.values() if (sd.size or 0) >= minimum]
+                subdirs.sort(key=lambda item: item[1].size, reverse=True)
+            else:
+                # Presorted: the shown subfolders are the ones before the first too small one
+                subdirs = index.subfolders(node_path)
+                shown = 0
+                while shown < len(subdirs) and (subdirs[shown][1].size or 0) >= minimum:
+                    shown += 1
+                subdirs = subdirs[:shown]
+            pruned = len(node._subnodes) - len(subdirs)
+            prefix = below
+            # Pushed in reverse order: the largest subfolder comes off the stack first
+            if pruned:
+                stack.append((None, pruned, prefix, True, None))
+            for i, (sd_path, sd) in enumerate(reversed(subdirs)):
+                stack.append((sd, depth + 1, prefix, i == 0 and not pruned, sd_path))
+        if chunk:
+            out.write('\n'.join(chunk) + '\n')
+
+
+def probe_width(size_renderer, largest):
+    '''
+    Width of the widest rendering of the sizes from 0 up to largest, probing the
+    renderer only just below the powers of 2 and 10, where renderings are widest
+    (e.g. "999B" or "1023.90KiB"), instead of rendering every size.
+    '''
+    probes = set([0, largest])
+    for base in (2, 10):
+        power = base
+        while power - 1 <= largest:
+            probes.add(power - 1)
+            probes.add(int(power * 0.9999))
+            power *= base
+    return max(len(size_renderer(size)) for size in probes)
+
+
+##############################################################################
+def build_du_tree(directory, extensions=False, owners=False, feedback=sys.stdout, writer=None, max_depth=None, files=None, keep_depth=None, fold_size=None, inode_order=False, guard=None, metrics=None):
+    '''
+    Build a tree of DirectoryTreeNodes, starting at the given directory.
+    Front end to scanengine.scan(), see there for the scan options
+    (writer, max_depth, keep_depth, fold_size, inode_order, guard).
+
+    @param extensions: also fill a per extension table (extTable) for every node
+    @param owners: key that table by (extension, owner uid) instead
+    @param feedback: stream for progress messages (None: no progress)
+    @param files: list to append (path, size) of every file to (e.g. for dedup.py)
+    @param metrics: names of the scan metrics (default: scanengine.DEFAULT_METRICS)
+    '''
+    import scanengine
+    metrics = list(metrics or scanengine.DEFAULT_METRICS)
+    if extensions or owners:
+        metrics.append(scanengine.ExtensionMetric(owners))
+    if files is not None:
+        metrics.append(scanengine.FileListMetric(files))
+    return scanengine.scan(directory, metrics, inode_order=inode_order, guard=guard, feedback=feedback, terminal_width=terminal_width,
+                           writer=writer, max_depth=max_depth, keep_depth=keep_depth, fold_size=fold_size, node_class=DirectoryTreeNode)
+
+def print_ext_tables(tree, max_depth=0, top=None):
+    '''
+    Print the extension table of the tree root and of each subtree down to max_depth.
+    '''
+    todo = [(tree, tree.name, 0)]
+    while todo:
+        node, path, depth = todo.pop(0)
+        print('')
+        print('Extensions: {0}'.format(path))
+        for line in node.ext_table().report(top):
+            print(line)
+        if depth < max_depth:
+            subdirs = sorted(node._subnodes.values(), key=lambda sd: sd.size, reverse=True)
+            todo[0:0] = [(sd, os.path.join(path, sd.name), depth + 1) for sd in subdirs]
+
+def print_queries(tree, queries, run_query=None):
+    '''
+    Print the results of treequery.TreeIndex queries on the tree
+    (or of run_query(query), e.g. answered by a duvizd daemon).
+    '''
+    import treequery
+    if run_query is None:
+        run_query = treequery.TreeIndex(tree).query
+    for query in queries:
+        try:
+            results = run_query(query)
+        except (ValueError, KeyError) as e:
+            sys.stderr.write('Warning: query {0}: {1}\n'.format(query, e))
+            continue
+        print('Query: {0} ({1} folders)'.format(query, len(results)))
+        for line in treequery.format_results(results, human_readable_byte_size):
+            print(line)
+
+def daemon_socket_path():
+    '''Default Unix socket path of the duvizd daemon (per user).'''
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return os.path.join(runtime, 'duviz.sock')
+    return os.path.join(os.environ.get('TMPDIR', '/tmp'), 'duviz-%d.sock' % os.getuid())
+
+def show_from_daemon(socket_path, paths, clioptions):
+    '''
+    Show the tree display (or --query results) of the paths, as answered by
+    a running duvizd daemon from its cached trees.
+    @return (paths to scan instead, False if the daemon could not answer for
+        some path): all paths if no daemon answers (e.g. stale socket),
+        otherwise the ones the daemon is still scanning
+    '''
+    import duvizd
+    try:
+        duvizd.request(socket_path, timeout=2.0, op='ping')
+    except (OSError, ValueError):
+        return paths, True
+    to_scan = []
+    ok = True
+    for directory in paths:
+        path = os.path.realpath(directory)
+        try:
+            if clioptions.queries:
+                # Fails (e.g. still scanning) before any query output
+                duvizd.request(socket_path, op='subtree', path=path)
+            else:
+                print (duvizd.request(socket_path, op='render', path=path, hist=clioptions.show_hist,
+                                      depth=clioptions.max_depth, threshold=clioptions.threshold))
+                continue
+        except duvizd.DaemonScanning as e:
+            sys.stderr.write('Warning: {0}: daemon {1}: scanning here instead\n'.format(directory, e))
+            to_scan.append(directory)
+            continue
+        except duvizd.DaemonError as e:
+            sys.stderr.write('Error: {0}: {1}\n'.format(directory, e))
+            ok = False
+            continue
+        def run_query(query):
+            return duvizd.request(socket_path, op='query', path=path, query=query)
+        print_queries(None, clioptions.queries, run_query)
+    return to_scan, ok
+
+# Output terminal width (in-process, no child processes for speedy startup).
+terminal_width = 80
+def getTerminalSize():
+    global terminal_width
+    terminal_width, ignore  = get_terminal_size()
+    terminal_width -= 1 # seems to be necessary on windows? \r vs \r\n ?
+
+##############################################################################
+# Defaults of the command line options. Also used directly (without
+# importing optparse) for the common invocation without any options.
+CLI_DEFAULTS = {
+    'onefilesystem': False,
+    'dereference': False,
+    'max_depth': 5,
+    'threshold': 1.0,
+    'inode_count': False,
+    'ages': False,
+    'metrics': 'bytes,alloc',
+    'show_progress': True,
+    'show_hist': False,
+    'ext_table': False,
+    'by_owner': False,
+    'ext_depth': 0,
+    'ext_top': 20,
+    'format': None,
+    'columns': 'size,alloc,files',
+    'output': None,
+    'dedup': False,
+    'dedup_workers': 4,
+    'watch': False,
+    'interval': 2.0,
+    'fold': False,
+    'fold_size': None,
+    'inode_order': False,
+    'timeout': None,
+    'retries': 2,
+    'queries': None,
+    'use_daemon': True,
+    'socket': None,
+    'treemap': None,
+}
+
+
+class CliOptions(object):
+    def __init__(self, **options):
+        self.__dict__.update(options)
+
+
+def make_cli_parser():
+    import optparse
+    cliparser = optparse.OptionParser(
+        '''usage: %prog [options] [DIRS]
+        %prog gives a graphic representation of the disk space
+        usage of the folder trees under DIRS.''',
+        version='%prog 1.0')
+    cliparser.add_option('-w', '--width',
+        action='store', type='int', dest='display_width', default=terminal_width,
+        help='total width of all bars', metavar='WIDTH')
+    cliparser.add_option('-x', '--one-file-system',
+        action='store_true', dest='onefilesystem',
+        help='skip directories on different filesystems')
+    cliparser.add_option('-L', '--dereference',
+        action='store_true', dest='dereference',
+        help='dereference all symbolic links')
+    cliparser.add_option('--max-depth',
+        action='store', type='int', dest='max_depth',
+        help='maximum recursion depth', metavar='N')
+    cliparser.add_option('--threshold',
+        action='store', type='float', dest='threshold',
+        help='leave directories smaller than PERCENT of their parent out of the tree display (default: 1)', metavar='PERCENT')
+    if (os.name != 'nt'):
+        cliparser.add_option('-i', '--inodes',
+            action='store_true', dest='inode_count',
+            help='also count inodes (hard linked files once), in the same scan')
+    cliparser.add_option('--ages',
+        action='store_true', dest='ages',
+        help='show the oldest file per directory')
+    cliparser.add_option('--metrics',
+        action='store', type='string', dest='metrics',
+        help='comma separated metrics to fill in during the scan: bytes, alloc, inodes, ages (default: bytes,alloc; -i and --ages add inodes and ages)',
+        metavar='LIST')
+    cliparser.add_option('--no-progress',
+        action='store_false', dest='show_progress',
+        help='disable progress reporting')
+    cliparser.add_option('--histogram',
+        action='store_true', dest='show_hist',
+        help='show a log2 file size histogram per directory')
+    cliparser.add_option('--ext-table',
+        action='store_true', dest='ext_table',
+        help='report bytes and file counts per file extension')
+    cliparser.add_option('--by-owner',
+        action='store_true', dest='by_owner',
+        help='split the extension table per owner uid (implies --ext-table)')
+    cliparser.add_option('--ext-depth',
+        action='store', type='int', dest='ext_depth',
+        help='also report the extension table per subtree down to depth N', metavar='N')
+    cliparser.add_option('--ext-top',
+        action='store', type='int', dest='ext_top',
+        help='number of rows per extension table (0: all)', metavar='N')
+    cliparser.add_option('--format',
+        action='store', type='choice', dest='format',
+        choices=['ndjson', 'csv', 'binary'],
+        help='write the tree as ndjson, csv or binary records (streamed during the scan, down to --max-depth)')
+    cliparser.add_option('--columns',
+        action='store', type='string', dest='columns',
+        help='comma separated columns for --format: size, alloc, own_size, own_alloc, files, own_files, largest, largest_name',
+        metavar='COLS')
+    cliparser.add_option('-o', '--output',
+        action='store', type='string', dest='output',
+        help='output file for --format (default: stdout)', metavar='FILE')
+    cliparser.add_option('--dedup',
+        action='store_true', dest='dedup',
+        help='find duplicate files and show the reclaimable bytes per directory')
+    cliparser.add_option('--dedup-workers',
+        action='store', type='int', dest='dedup_workers',
+        help='number of threads reading files for --dedup', metavar='N')
+    cliparser.add_option('--watch',
+        action='store_true', dest='watch',
+        help='keep watching the directory and refresh the display on changes')
+    cliparser.add_option('--interval',
+        action='store', type='float', dest='interval',
+        help='polling interval for --watch (default: 2 seconds)', metavar='SECONDS')
+    cliparser.add_option('--fold',
+        action='store_true', dest='fold',
+        help='only keep directory nodes down to --max-depth, fold deeper ones into their totals (saves memory)')
+    cliparser.add_option('--fold-below',
+        action='store', type='int', dest='fold_size',
+        help='fold the subdirectories of directories smaller than SIZE bytes, as soon as they are scanned (saves memory)', metavar='SIZE')
+    cliparser.add_option('--inode-order',
+        action='store_true', dest='inode_order',
+        help='scan in inode order (faster on spinning disks)')
+    cliparser.add_option('--timeout',
+        action='store', type='float', dest='timeout',
+        help='skip directories that do not respond within SECONDS (e.g. hung network mounts) or can not be read, instead of blocking or aborting',
+        metavar='SECONDS')
+    cliparser.add_option('--retries',
+        action='store', type='int', dest='retries',
+        help='number of retries for --timeout (default: 2)', metavar='N')
+    cliparser.add_option('--query',
+        action='append', type='string', dest='queries',
+        help='list folders instead of the tree display: "size>100G", "size<1M", "top=10" or "path=DIR" (folder and its children). Can be given multiple times.',
+        metavar='QUERY')
+    cliparser.add_option('--treemap',
+        action='store', type='string', dest='treemap',
+        help='write a zoomable HTML/SVG treemap to DIR (DIR/index.html) instead of the tree display', metavar='DIR')
+    if (os.name != 'nt'):
+        cliparser.add_option('--socket',
+            action='store', type='string', dest='socket',
+            help='socket of the duvizd daemon to ask before scanning (default: %s)' % daemon_socket_path(), metavar='PATH')
+        cliparser.add_option('--no-daemon',
+            action='store_false', dest='use_daemon',
+            help='always scan, even if a duvizd daemon is running')
+
+    cliparser.set_defaults(**CLI_DEFAULTS)
+    return cliparser
+
+
+def parse_cli(args):
+    '''
+    @return (options, positional arguments)
+    '''
+    if not any(arg.startswith('-') for arg in args):
+        # Fast path: only directories given, skip the optparse import.
+        return CliOptions(display_width=terminal_width, **CLI_DEFAULTS), list(args)
+    return make_cli_parser().parse_args(args)
+
+
+##############################################################################
+def main():
+
+    getClusterSize()
+    getTerminalSize()
+
+    # TODO block/tree display option
+
+    #########################################
+    # Handle commandline interface.
+    (clioptions, cliargs) = parse_cli(sys.argv[1:])
+
+    ########################################
+    # Make sure we have a valid list of paths
+
+    paths = ['.']  # Do current dir if no dirs are given.
+    if len(cliargs) > 0:
+        paths = []
+        for path in cliargs:
+            if os.path.exists(path):
+                paths.append(path)
+            else:
+                sys.stderr.write('Warning: not a valid path: "%s"\n' % path)
+
+    if clioptions.show_progress:
+        feedback = sys.stdout
+    else:
+        feedback = None
+
+    import scanengine
+    try:
+        metrics = scanengine.parse_metrics(clioptions.metrics)
+    except ValueError as e:
+        make_cli_parser().error(str(e))
+    for name, wanted in [('inodes', clioptions.inode_count), ('ages', clioptions.ages)]:
+        if wanted and name not in metrics:
+            metrics.append(name)
+
+    # Plain tree displays and queries can come from the daemon's cached trees.
+    daemon_ok = True
+    if (os.name != 'nt' and clioptions.use_daemon and not (clioptions.format or clioptions.watch or clioptions.dedup
+            or clioptions.ext_table or clioptions.by_owner or clioptions.fold or clioptions.fold_size or clioptions.timeout
+            or set(metrics) != set(scanengine.DEFAULT_METRICS) or clioptions.treemap)):
+        socket_path = clioptions.socket or daemon_socket_path()
+        if os.path.exists(socket_path):
+            # Left to scan here: the paths the daemon is still scanning (all without a daemon)
+            paths, daemon_ok = show_from_daemon(socket_path, paths, clioptions)
+
+    guard = None
+    if clioptions.timeout:
+        import stallguard
+        guard = stallguard.StallGuard(timeout=clioptions.timeout, retries=clioptions.retries)
+
+    if clioptions.format:
+        import treeformat
+        try:
+            columns = treeformat.parse_columns(clioptions.columns)
+        except ValueError as e:
+            make_cli_parser().error(str(e))
+        if clioptions.output:
+            out = open(clioptions.output, 'wb')
+        else:
+            out = sys.stdout.buffer
+            # keep progress messages out of the data stream
+            feedback = feedback and sys.stderr
+        writer = treeformat.get_writer(clioptions.format, out, columns)
+        keep_depth = clioptions.max_depth if clioptions.fold else None
+        for directory in paths:
+            build_du_tree(directory, feedback=feedback, writer=writer, max_depth=clioptions.max_depth, keep_depth=keep_depth,
+                          inode_order=clioptions.inode_order, guard=guard, metrics=metrics)
+        writer.close()
+        if clioptions.output:
+            out.close()
+        for line in (guard.report() if guard else []):
+            sys.stderr.write(line + '\n')
+        return
+
+    if clioptions.watch:
+        if len(paths) > 1:
+            make_cli_parser().error('--watch takes a single directory')
+        import watch
+        tree = build_du_tree(paths[0], feedback=feedback, inode_order=clioptions.inode_order, guard=guard)
+        def render():
+            sys.stdout.write('\x1b[2J\x1b[H')
+            tree.write_tree_display(sys.stdout, show_hist=clioptions.show_hist, max_depth=clioptions.max_depth,
+                                    threshold=clioptions.threshold)
+        watch.watch(tree, render, interval=clioptions.interval)
+        return
+
+    if clioptions.treemap and len(paths) > 1:
+        make_cli_parser().error('--treemap takes a single directory')
+
+    track_ext = clioptions.ext_table or clioptions.by_owner
+    keep_depth = clioptions.max_depth if clioptions.fold else None
+    for directory in paths:
+        files = [] if clioptions.dedup else None
+        tree = build_du_tree(directory, extensions=track_ext, owners=clioptions.by_owner, feedback=feedback, files=files,
+                             keep_depth=keep_depth, fold_size=clioptions.fold_size, inode_order=clioptions.inode_order, guard=guard,
+                             metrics=metrics)
+        if clioptions.dedup:
+            import dedup
+            groups = dedup.find_duplicates(files, workers=clioptions.dedup_workers)
+            dedup.apply_to_tree(tree, groups)
+        if clioptions.treemap:
+            import treemap
+            views, no_view = treemap.export(tree, clioptions.treemap, size_renderer=human_readable_byte_size)
+            print('Treemap: {0} ({1} views)'.format(os.path.join(clioptions.treemap, 'index.html'), views))
+            if no_view:
+                sys.stderr.write('Warning: treemap view limit reached, {0} folders are not zoomable (dashed border)\n'.format(no_view))
+        elif clioptions.queries:
+            print_queries(tree, clioptions.queries)
+        else:
+            tree.write_tree_display(sys.stdout, show_hist=clioptions.show_hist, show_dupes=clioptions.dedup,
+                                    show_inodes='inodes' in metrics, show_ages='ages' in metrics,
+                                    max_depth=clioptions.max_depth, threshold=clioptions.threshold)
+        if clioptions.dedup:
+            print('')
+            print('Duplicates: {0} groups, {1} reclaimable'.format(len(groups), human_readable_byte_size(dedup.reclaimable(groups))))
+        if track_ext:
+            print_ext_tables(tree, clioptions.ext_depth, clioptions.ext_top)
+        if guard and guard.skipped:
+            print('')
+            for line in guard.report():
+                print(line)
+            del guard.skipped[:]
+        #print (tree.block_display(clioptions.display_width, max_depth=clioptions.max_depth))
+    if not daemon_ok:
+        sys.exit(1)
+
+# TODO display largest file (in tree)
+
+# TODO display size in "this" folder (?)
+
+# TODO file age statistics
+# TODO file outlier statistics
+
+# TODO question: only track "my" data (at per-node level) and roll-up accumulated data later?
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+'''
+duviz daemon: keeps scanned trees in memory and answers requests over a
+Unix domain socket, so several tools (and repeated duviz.py runs) do not
+each rescan the same volumes.
+
+    python duvizd.py [--socket PATH] [DIRS to preload]
+
+duviz.py detects a running daemon (see duviz.daemon_socket_path()) and asks
+it for the tree display or --query results instead of scanning.
+
+Protocol: one JSON object per line in both directions. Requests have an
+"op" and, except for "ping", an absolute "path":
+
+    {"op": "render", "path": "/data", "hist": false, "depth": 1, "threshold": 0}
+                                                       tree display text (see DirectoryTreeNode.tree_display)
+    {"op": "subtree", "path": "/data/x"}               [[size, path], ...] of the folder and its children
+    {"op": "top", "path": "/data", "n": 10}            [[size, path], ...] of the n largest folders
+    {"op": "query", "path": "/data", "query": "size>1G"}   see treequery.TreeIndex.query
+    {"op": "refresh", "path": "/data"}                 drop the cached tree and rescan
+    {"op": "ping"}                                     daemon pid and cached roots
+
+Responses are {"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+
+A path inside a cached root is served from that root's tree, other paths are
+scanned (and cached) on first use, in the background: a request waits at most
+--scan-wait seconds for the scan, then gets {"ok": false, "scanning": true,
+"error": "..."} and can ask again later. At most --max-roots trees are kept, the
+least recently used one is dropped first. Cached trees are kept up to date in
+the background with watch.TreeWatcher: only changed directories are rescanned.
+'''
+
+import collections
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import duviz
+
+
+class DaemonError(ValueError):
+    '''The daemon could not answer a request.'''
+    pass
+
+
+class DaemonScanning(DaemonError):
+    '''The daemon is still scanning the requested path: ask again later.'''
+    pass
+
+
+class _Root(object):
+    '''A cached tree.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()  # held while updating or reading the tree
+        self.ready = threading.Event()  # set when the first scan is done (or failed)
+        self.error = None  # OSError of a failed scan
+        self.closed = False
+        self.tree = None
+        self.watcher = None
+        self.index = None  # treequery.TreeIndex, rebuilt after changes
+        self.scanned = None
+
+    def close(self):
+        self.closed = True
+        if self.watcher is not None:
+            self.watcher.close()
+
+
+class TreeCache(object):
+    '''
+    LRU cache of scanned trees, answering the requests of the protocol.
+
+    @param max_roots maximum number of cached trees
+    @param use_inotify keep the trees up to date with inotify where available
+        (otherwise the directory modification times are polled)
+    @param scan_wait seconds a request waits for the scan of an uncached path
+        (None: until it is done)
+    '''
+
+    def __init__(self, max_roots=4, use_inotify=True, scan_wait=5.0):
+        self.max_roots = max_roots
+        self.use_inotify = use_inotify
+        self.scan_wait = scan_wait
+        self._roots = collections.OrderedDict()  # path -> _Root, least recently used first
+        self._lock = threading.Lock()
+
+    def _find(self, path):
+        # Cached root containing path (with self._lock held), or None
+        for root_path in self._roots:
+            if path == root_path or path.startswith(root_path.rstrip(os.path.sep) + os.path.sep):
+                return self._roots[root_path]
+        return None
+
+    def root(self, path, wait=None):
+        '''
+        @return the (scanned) _Root containing path, scanning path first if needed
+        @param wait seconds to wait for the scan (default: scan_wait)
+        @raise DaemonScanning if the scan is not done in time (it goes on in
+            the background), OSError if the scan failed
+        '''
+        evicted = []
+        scan = None
+        with self._lock:
+            root = self._find(path)
+            if root is None:
+                root = self._roots[path] = _Root(path)
+                while len(self._roots) > self.max_roots:
+                    evicted.append(self._roots.popitem(last=False)[1])
+                scan = threading.Thread(target=self._scan, args=(root,), name='duvizd-scan')
+                scan.daemon = True
+            self._roots.move_to_end(root.path)
+        for old in evicted:
+            with old.lock:
+                old.close()
+        if scan is not None:
+            scan.start()
+        if not root.ready.wait(self.scan_wait if wait is None else wait):
+            raise DaemonScanning('still scanning %s, try again later' % root.path)
+        if root.error is not None:
+            raise root.error
+        return root
+
+    def _scan(self, root):
+        # First scan of a root, in a background thread
+        import watch
+        try:
+            tree = duviz.build_du_tree(root.path, feedback=None)
+            watcher = watch.TreeWatcher(tree, use_inotify=self.use_inotify)
+        except OSError as e:
+            with self._lock:
+                if self._roots.get(root.path) is root:
+                    del self._roots[root.path]
+            root.error = e
+        else:
+            with root.lock:
+                if root.closed:
+                    # Dropped from the cache while scanning
+                    watcher.close()
+                else:
+                    root.tree = tree
+                    root.watcher = watcher
+                    root.scanned = time.time()
+        finally:
+            root.ready.set()
+
+    def drop(self, path):
+        with self._lock:
+            root = self._roots.pop(path, None)
+        if root is not None:
+            with root.lock:
+                root.close()
+
+    def roots(self):
+        with self._lock:
+            return list(self._roots.values())
+
+    def refresh_stale(self):
+        '''
+        Rescan the directories that changed since the last call, in all cached trees.
+        @return number of trees that changed
+        '''
+        changed = 0
+        for root in self.roots():
+            with root.lock:
+                if root.watcher is not None and root.watcher.update(0):
+                    root.index = None
+                    changed += 1
+        return changed
+
+    def _index(self, root, path):
+        # TreeIndex of the (sub)tree at path, with root.lock held
+        import treequery
+        if root.index is None:
+            root.index = treequery.TreeIndex(root.tree)
+        if path == root.path:
+            return root.index
+        node = root.index.lookup(path)
+        if node is None:
+            raise KeyError(path)
+        return treequery.TreeIndex(node, path)
+
+    def handle(self, request):
+        '''
+        Answer one request (a dict, see the module docstring).
+        @return the result (JSON serializable)
+        '''
+        op = request.get('op')
+        if op == 'ping':
+            return {'pid': os.getpid(), 'roots': [[root.path, root.scanned] for root in self.roots()]}
+        path = request.get('path')
+        if not path or not os.path.isabs(path):
+            raise DaemonError('absolute path required')
+        path = os.path.normpath(path)
+        if op == 'refresh':
+            with self._lock:
+                root = self._find(path)
+            if root is not None:
+                self.drop(root.path)
+                path = root.path
+            return self.root(path).scanned
+        if op not in ('render', 'subtree', 'top', 'query'):
+            raise DaemonError('unknown op: %r' % op)
+
+        root = self.root(path)
+        with root.lock:
+            if op == 'render':
+                # The cached index of the whole root: its presorted children give the display order
+                index = self._index(root, root.path)
+                node = index.lookup(path)
+                if node is None:
+                    raise KeyError(path)
+                name = node.name
+                node.name = path  # show the full path, like a scan of path itself
+                try:
+                    return node.tree_display(show_hist=bool(request.get('hist')), max_depth=request.get('depth', 1),
+                                             threshold=float(request.get('threshold', 0)), index=index, path=path)
+                finally:
+                    node.name = name
+            if op == 'subtree':
+                return self._index(root, path).listing(path)
+            if op == 'top':
+                return self._index(root, path).top(int(request.get('n', 10)))
+            return self._index(root, path).query(request.get('query', ''))
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = {'ok': True, 'result': self.server.cache.handle(json.loads(line.decode('utf-8')))}
+            except DaemonScanning as e:
+                response = {'ok': False, 'scanning': True, 'error': str(e)}
+            except KeyError as e:
+                response = {'ok': False, 'error': 'not in the tree: %s' % e.args[0]}
+            except (ValueError, OSError) as e:
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''
+    The daemon: a threaded Unix socket server around a TreeCache, plus a
+    background thread refreshing changed directories every interval seconds.
+    '''
+    daemon_threads = True
+
+    def __init__(self, socket_path, cache, interval=30.0):
+        # Refuse to take over the socket of a running daemon, remove a stale one.
+        if os.path.exists(socket_path):
+            try:
+                request(socket_path, timeout=2.0, op='ping')
+            except (OSError, ValueError):
+                os.unlink(socket_path)
+            else:
+                raise DaemonError('daemon already running on %s' % socket_path)
+        umask = os.umask(0o077)  # only the user may connect
+        try:
+            socketserver.UnixStreamServer.__init__(self, socket_path, _Handler)
+        finally:
+            os.umask(umask)
+        self.cache = cache
+        self.interval = interval
+        self._stop = threading.Event()
+        self._refresher = threading.Thread(target=self._refresh_loop, name='duvizd-refresh')
+        self._refresher.daemon = True
+        self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.interval):
+            self.cache.refresh_stale()
+
+    def server_close(self):
+        self._stop.set()
+        socketserver.UnixStreamServer.server_close(self)
+        for root in self.cache.roots():
+            self.cache.drop(root.path)
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def request(socket_path, timeout=None, **request):
+    '''
+    Send one request to the daemon (see the module docstring).
+    @return the result
+    @raise OSError if no daemon listens on socket_path, DaemonError if it refuses the request
+        (DaemonScanning if it is still scanning the path)
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    finally:
+        sock.close()
+    if not line:
+        raise DaemonError('no response')
+    response = json.loads(line.decode('utf-8'))
+    if not response['ok']:
+        if response.get('scanning'):
+            raise DaemonScanning(response['error'])
+        raise DaemonError(response['error'])
+    return response['result']
+
+
+def main():
+    import optparse
+    cliparser = optparse.OptionParser('''usage: %prog [options] [DIRS]
+        %prog keeps scanned trees in memory and serves them to duviz.py
+        over a Unix socket. DIRS are scanned right away.''')
+    cliparser.add_option('--socket',
+        action='store', type='string', dest='socket', default=duviz.daemon_socket_path(),
+        help='socket path (default: %default)', metavar='PATH')
+    cliparser.add_option('--max-roots',
+        action='store', type='int', dest='max_roots', default=4,
+        help='number of trees to keep in memory (default: %default)', metavar='N')
+    cliparser.add_option('--interval',
+        action='store', type='float', dest='interval', default=30.0,
+        help='seconds between background refreshes of changed directories (default: %default)', metavar='SECONDS')
+    cliparser.add_option('--poll',
+        action='store_false', dest='use_inotify', default=True,
+        help='poll directory modification times instead of using inotify')
+    cliparser.add_option('--scan-wait',
+        action='store', type='float', dest='scan_wait', default=5.0,
+        help='seconds a request waits for the scan of a new directory before answering that it is still scanning'
+             ' (default: %default)', metavar='SECONDS')
+    (clioptions, cliargs) = cliparser.parse_args()
+
+    # Clean up (remove the socket) on kill, like on Ctrl-C.
+    import signal
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    duviz.getClusterSize()
+    cache = TreeCache(clioptions.max_roots, clioptions.use_inotify, clioptions.scan_wait)
+    try:
+        server = DaemonServer(clioptions.socket, cache, clioptions.interval)
+    except DaemonError as e:
+        cliparser.error(str(e))
+    try:
+        for directory in cliargs:
+            # Scanned in the background while serving
+            try:
+                cache.root(os.path.realpath(directory), wait=0)
+            except DaemonScanning:
+                pass
+        sys.stderr.write('duvizd: listening on %s\n' % clioptions.socket)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+'''
+Growth history: per folder time series of the totals of DirectoryTree scans
+(totSize, totCount, totAlloc) in a SQLite database.
+
+Tables:
+    paths      interned folder paths (id, path)
+    snapshots  one row per recorded scan (id, root, taken)
+    samples    (path id, snapshot id, size, count, alloc), only for the folders
+               whose totals changed since they were recorded last.
+               A removed folder gets a sample with zero totals.
+    latest     the most recent totals per path id, to detect changes without
+               going through the samples
+
+So a folder that does not change costs nothing per snapshot. The growth
+report looks up one sample per folder (through the primary key index),
+it does not load the snapshots.
+'''
+
+import os
+import sqlite3
+import time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS paths (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    root TEXT NOT NULL,
+    taken REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    path_id INTEGER NOT NULL,
+    snapshot_id INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    alloc INTEGER NOT NULL,
+    PRIMARY KEY (path_id, snapshot_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS latest (
+    path_id INTEGER PRIMARY KEY,
+    size INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    alloc INTEGER NOT NULL
+);
+'''
+
+
+def _subtree_range(root):
+    # Path range (lo, hi) of the paths strictly below root, for index range scans:
+    # every such path starts with root + separator, hi is the next string after that prefix.
+    prefix = root.rstrip(os.path.sep) + os.path.sep
+    return prefix, prefix[:-1] + chr(ord(os.path.sep) + 1)
+
+
+def iter_folders(tree, root):
+    '''
+    @return generator of (path, node) of an accumulated DirectoryTree (pre-order)
+    '''
+    todo = [(root, tree)]
+    while todo:
+        path, node = todo.pop()
+        yield path, node
+        todo.extend((os.path.join(path, name), sub) for name, sub in node.subnodes.items())
+
+
+class History(object):
+    '''
+    Growth history database, see the module docstring.
+    '''
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def _latest(self, root):
+        # {path: (path id, size, count, alloc)} of the folders at and below root
+        lo, hi = _subtree_range(root)
+        rows = self.db.execute(
+            'SELECT p.path, p.id, l.size, l.count, l.alloc FROM paths p JOIN latest l ON l.path_id = p.id'
+            ' WHERE p.path = ? OR (p.path >= ? AND p.path < ?)', (root, lo, hi))
+        return dict((row[0], row[1:]) for row in rows)
+
+    def _path_id(self, path):
+        cursor = self.db.execute('INSERT OR IGNORE INTO paths (path) VALUES (?)', (path,))
+        if cursor.rowcount:
+            return cursor.lastrowid
+        return self.db.execute('SELECT id FROM paths WHERE path = ?', (path,)).fetchone()[0]
+
+    def record(self, tree, root, taken=None):
+        '''
+        Add a snapshot of an accumulated DirectoryTree, in one transaction.
+        @param root full path of the tree root
+        @return (snapshot id, number of samples written)
+        '''
+        if taken is None:
+            taken = time.time()
+        with self.db:
+            latest = self._latest(root)
+            snapshot = self.db.execute('INSERT INTO snapshots (root, taken) VALUES (?, ?)', (root, taken)).lastrowid
+            samples = []
+            for path, node in iter_folders(tree, root):
+                values = (node.totSize, node.totCount, node.totAlloc)
+                known = latest.pop(path, None)
+                if known is None:
+                    samples.append((self._path_id(path),) + values)
+                elif known[1:] != values:
+                    samples.append((known[0],) + values)
+            # Folders that are gone
+            samples.extend((known[0], 0, 0, 0) for known in latest.values())
+
+            self.db.executemany('INSERT INTO samples (path_id, snapshot_id, size, count, alloc) VALUES (?, ?, ?, ?, ?)',
+                                [(sample[0], snapshot) + sample[1:] for sample in samples])
+            self.db.executemany('INSERT OR REPLACE INTO latest (path_id, size, count, alloc) VALUES (?, ?, ?, ?)', samples)
+            self.db.executemany('DELETE FROM latest WHERE path_id = ?', [(known[0],) for known in latest.values()])
+        return snapshot, len(samples)
+
+    def growth(self, root, since, top=20):
+        '''
+        Fastest growing folders at and below root since a point in time.
+        Folders that did not exist yet at that time grew from zero.
+
+        @param since time (seconds since the epoch) to compare the latest totals with
+        @return list of (path, size then, size now, count then, count now) of the folders
+            that grew, largest growth first
+        '''
+        row = self.db.execute('SELECT MAX(id) FROM snapshots WHERE taken <= ?', (since,)).fetchone()
+        before = row[0] if row[0] is not None else 0
+        lo, hi = _subtree_range(root)
+        return self.db.execute('''
+            SELECT p.path, COALESCE(t.size, 0), l.size, COALESCE(t.count, 0), l.count
+            FROM paths p JOIN latest l ON l.path_id = p.id
+            LEFT JOIN samples t ON t.path_id = l.path_id AND t.snapshot_id =
+                (SELECT MAX(s.snapshot_id) FROM samples s WHERE s.path_id = l.path_id AND s.snapshot_id <= :before)
+            WHERE (p.path = :root OR (p.path >= :lo AND p.path < :hi)) AND l.size > COALESCE(t.size, 0)
+            ORDER BY l.size - COALESCE(t.size, 0) DESC
+            LIMIT :top''', {'before': before, 'root': root, 'lo': lo, 'hi': hi, 'top': top}).fetchall()
+
+    def snapshots(self, root):
+        '''@return list of (snapshot id, taken) of the scans of root'''
+        return self.db.execute('SELECT id, taken FROM snapshots WHERE root = ? ORDER BY id', (root,)).fetchall()
+
+
+def growth_report(rows, days, size_renderer=str):
+    '''
+    @return report lines for History.growth() rows over a window of days
+    '''
+    lines = []
+    for path, size_then, size_now, count_then, count_now in rows:
+        grown = size_now - size_then
+        lines.append('{0:>12} {1:>12}/day {2:>+8} files  {3}'.format(
+            size_renderer(grown), size_renderer(int(grown / days)), count_now - count_then, path))
+    return lines
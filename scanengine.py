@@ -0,0 +1,394 @@
+'''
+Scan engine: one directory walk that fills a tree of duviz.DirectoryTreeNode
+with any combination of pluggable metrics, so e.g. sizes and inode counts
+come from the same pass over the file system. duviz.build_du_tree() is a
+front end to scan(), du.py walks the tree with walk().
+
+Metrics (see METRICS):
+    bytes   file sizes, file counts, largest file, size histogram
+    alloc   allocated size (see AllocatedSize)
+    inodes  number of inodes (folders included, hard linked files once)
+    ages    oldest file (earliest of creation/change and modification time)
+
+Other Metric subclasses act as hooks that need arguments, e.g.
+ExtensionMetric (per extension table) and FileListMetric (collect the files).
+
+Also home of the file system helpers shared by duviz.py, du.py and
+DirectoryTree.py: path_split, getClusterSize, AllocatedSize and list_folder.
+'''
+
+import os
+import stat
+
+gClusterSize = None
+
+
+def path_split(path, base=''):
+    '''
+    Split a file system path in a list of path components (as a recursive os.path.split()),
+    optionally only up to a given base path.
+    '''
+    if base.endswith(os.path.sep):
+        base = base.rstrip(os.path.sep)
+    items = []
+    while True:
+        if path == base:
+            items.insert(0, path)
+            break
+        path, tail = os.path.split(path)
+        if tail != '':
+            items.insert(0, tail)
+        if path == '':
+            break
+        if path == '/':
+            items.insert(0, path)
+            break
+    return items
+
+
+# For Windows: determine the cluster size for allocated file size
+def getClusterSize():
+    global gClusterSize
+    gClusterSize = None
+
+    if (os.name == 'nt'):
+        import ctypes
+        sectorsPerCluster = ctypes.c_ulonglong(0)
+        bytesPerSector = ctypes.c_ulonglong(0)
+        rootPathName = ctypes.c_wchar_p(u"c:\\") # TODO change to drive being scanned!
+        ctypes.windll.kernel32.GetDiskFreeSpaceW(rootPathName,ctypes.pointer(sectorsPerCluster),ctypes.pointer(bytesPerSector),None,None)
+        gClusterSize = (int)(sectorsPerCluster.value) * (int)(bytesPerSector.value)
+    return gClusterSize
+
+
+def AllocatedSize(size):
+    '''File size rounded up to whole clusters (the size itself if the cluster size is unknown).'''
+    if (gClusterSize != None):
+        return -(-size // gClusterSize) * gClusterSize
+    return size
+
+
+##############################################################################
+class Metric(object):
+    '''
+    A pluggable scan metric: keeps its own attributes of the tree nodes up to date.
+    The folders and files below a folded node (see scan() keep_depth) are passed
+    with own=False: they only count in the inclusive totals of that node.
+    '''
+    name = None
+
+    def start(self, node):
+        '''Initialize the attributes of a new node.'''
+        pass
+
+    def folder(self, node, path, own=True):
+        '''Called once for every folder, path: its full path.'''
+        pass
+
+    def file(self, node, path, name, st, own=True):
+        '''Called for every file, path: full path of its folder, st: its stat result.'''
+        pass
+
+    def roll_up(self, node, sub):
+        '''Add the inclusive totals of a finished subnode to node.'''
+        pass
+
+
+class BytesMetric(Metric):
+    name = 'bytes'
+
+    def file(self, node, path, name, st, own=True):
+        size = st.st_size
+        if own:
+            node.mySize += size
+            node.myFileCount += 1
+            if size > node.myLargestFileSize:
+                node.myLargestFileSize, node.myLargestFileName = size, name
+        node.size += size
+        node.fileCount += 1
+        node.sizeHist.add(size)
+        if size > node.largestFileSize:
+            node.largestFileSize, node.largestFileName = size, name
+
+    def roll_up(self, node, sub):
+        node.size += sub.size
+        node.fileCount += sub.fileCount
+        node.sizeHist.merge(sub.sizeHist)
+        if sub.largestFileSize > node.largestFileSize:
+            node.largestFileSize, node.largestFileName = sub.largestFileSize, sub.largestFileName
+
+
+class AllocMetric(Metric):
+    name = 'alloc'
+
+    def file(self, node, path, name, st, own=True):
+        alloc = AllocatedSize(st.st_size)
+        if own:
+            node.myAllocSize += alloc
+        node.allocSize += alloc
+
+    def roll_up(self, node, sub):
+        node.allocSize += sub.allocSize
+
+
+class InodeMetric(Metric):
+    name = 'inodes'
+
+    def __init__(self):
+        # Only files with more than one link need remembering
+        self.seen = set()
+
+    def folder(self, node, path, own=True):
+        if own:
+            node.myInodeCount += 1
+        node.inodeCount += 1
+
+    def file(self, node, path, name, st, own=True):
+        if st.st_nlink > 1:
+            key = (st.st_dev, st.st_ino)
+            if key in self.seen:
+                return
+            self.seen.add(key)
+        if own:
+            node.myInodeCount += 1
+        node.inodeCount += 1
+
+    def roll_up(self, node, sub):
+        node.inodeCount += sub.inodeCount
+
+
+class AgeMetric(Metric):
+    name = 'ages'
+
+    def file(self, node, path, name, st, own=True):
+        # Windows HACK: on copying files, the 'create' date can be AFTER the 'modify' date
+        date = min(st.st_ctime, st.st_mtime)
+        if own and (node.myOldestFileName == '' or date < node.myOldestFileDate):
+            node.myOldestFileDate, node.myOldestFileName = date, name
+        if node.oldestFileName == '' or date < node.oldestFileDate:
+            node.oldestFileDate, node.oldestFileName = date, name
+
+    def roll_up(self, node, sub):
+        if sub.oldestFileName != '' and (node.oldestFileName == '' or sub.oldestFileDate < node.oldestFileDate):
+            node.oldestFileDate, node.oldestFileName = sub.oldestFileDate, sub.oldestFileName
+
+
+class ExtensionMetric(Metric):
+    '''
+    Per extension table (duviz.ExtensionTable) of the files of every node,
+    keyed by (extension, owner uid) with owners=True. Folded files go in the
+    table of the folded node.
+    '''
+    name = 'extensions'
+
+    def __init__(self, owners=False):
+        from duviz import ExtensionTable, file_extension
+        self.table = ExtensionTable
+        self.extension = file_extension
+        self.owners = owners
+
+    def start(self, node):
+        node.extTable = self.table()
+
+    def file(self, node, path, name, st, own=True):
+        key = self.extension(name)
+        if self.owners:
+            key = (key, st.st_uid)
+        node.extTable.add(key, st.st_size)
+
+
+class FileListMetric(Metric):
+    '''Append (full path, size) of every file to a list (e.g. for dedup.py).'''
+    name = 'files'
+
+    def __init__(self, files):
+        self.files = files
+
+    def file(self, node, path, name, st, own=True):
+        self.files.append((os.path.join(path, name), st.st_size))
+
+
+METRICS = dict((m.name, m) for m in [BytesMetric, AllocMetric, InodeMetric, AgeMetric])
+DEFAULT_METRICS = ['bytes', 'alloc']
+
+
+def parse_metrics(text):
+    '''
+    Parse a comma separated list of metric names.
+    @raise ValueError on unknown metrics
+    '''
+    metrics = [m.strip() for m in text.split(',') if m.strip()]
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown:
+        raise ValueError('unknown metric(s): %s (choose from %s)' % (', '.join(unknown), ', '.join(sorted(METRICS))))
+    return metrics
+
+
+##############################################################################
+def list_folder(directory, inode_order=False):
+    '''
+    List and stat the entries of a folder in one go. Only a failure to list the
+    folder itself raises OSError. Symbolic links to files count as the file they
+    point to, dangling links as (link) files, symbolic links to folders are
+    skipped (not followed, so there are no loops). Entries removed while
+    listing are left out.
+    @param inode_order: sort the entries by inode number (before they are stat'ed)
+    @return (list of (file name, stat result), list of (subfolder name, inode number))
+    '''
+    files = []
+    folders = []
+    with os.scandir(directory) as it:
+        entries = sorted(it, key=lambda e: e.inode()) if inode_order else list(it)
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                folders.append((entry.name, entry.inode()))
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                st = entry.stat(follow_symlinks=False)  # dangling link
+        except OSError:
+            continue  # vanished while scanning
+        if not stat.S_ISDIR(st.st_mode):
+            files.append((entry.name, st))
+    return files, folders
+
+
+def walk(top, inode_order=False, onerror=None):
+    '''
+    Like os.walk(top), but the files come stat'ed (see list_folder):
+    yields (folder, list of subfolder names, list of (file name, stat result)).
+    As with os.walk, the caller can prune the subfolder names in place.
+
+    @param inode_order: friendly to spinning disks: the entries of every folder
+        are stat'ed in inode order, and the pending folders are kept in one
+        queue ordered by inode number (instead of depth first), so the disk
+        head moves mostly forward.
+    @param onerror: called with the OSError of a folder that can not be listed
+    '''
+    if inode_order:
+        import heapq
+    # Pending folders: heap of (inode, path) in inode order, a stack otherwise
+    pending = [(0, top)]
+    while pending:
+        ino, folder = heapq.heappop(pending) if inode_order else pending.pop()
+        try:
+            files, folders = list_folder(folder, inode_order)
+        except OSError as e:
+            if onerror is not None:
+                onerror(e)
+            continue
+        names = [name for name, ino in folders]
+        yield folder, names, files
+        inodes = dict(folders)
+        if inode_order:
+            for name in names:
+                heapq.heappush(pending, (inodes[name], os.path.join(folder, name)))
+        else:
+            pending.extend((inodes[name], os.path.join(folder, name)) for name in reversed(names))
+
+
+def scan(directory, metrics=DEFAULT_METRICS, inode_order=False, guard=None, feedback=None, terminal_width=80,
+         writer=None, max_depth=None, keep_depth=None, fold_size=None, node_class=None):
+    '''
+    Build a tree of duviz.DirectoryTreeNode in one walk, starting at the given directory.
+
+    @param metrics: names of the metrics to fill in (see METRICS) and/or Metric
+        instances (e.g. ExtensionMetric, FileListMetric)
+    @param inode_order: list and descend the entries of each folder in inode
+        order, which avoids random seeks on spinning disks
+    @param guard: stallguard.StallGuard to list the folders with. Folders that
+        stall or can not be read are then skipped (recorded in the guard and
+        marked incomplete) instead of blocking or aborting the scan.
+    @param feedback: stream for progress messages (None: no progress)
+    @param writer: treeformat.TreeWriter to stream the folders to as soon as
+        they are scanned (post-order). Written subtrees are not kept in memory,
+        so only the root node is returned.
+    @param max_depth: only write folders down to this depth
+    @param keep_depth: only create nodes down to this depth, deeper folders are
+        folded into the inclusive totals of their ancestor at keep_depth
+        (marked collapsed)
+    @param fold_size: drop the subnodes of every folder smaller than this many
+        bytes (see DirectoryTreeNode.collapse), as soon as the folder is
+        finished. So besides the kept tree, only the subfolders of the
+        folders still being scanned are in memory (collapsed if small).
+    @param node_class: class of the tree nodes (default: duviz.DirectoryTreeNode)
+    '''
+    if node_class is None:
+        from duviz import DirectoryTreeNode as node_class
+    metrics = [METRICS[m]() if isinstance(m, str) else m for m in metrics]
+
+    def new_node(name):
+        node = node_class(name)
+        for metric in metrics:
+            metric.start(node)
+        return node
+
+    def visit(path, node, own=True):
+        # Scan the folder itself, @return its subfolder names
+        for metric in metrics:
+            metric.folder(node, path, own)
+        try:
+            if guard is None:
+                files, folders = list_folder(path, inode_order)
+            else:
+                files, folders = guard.call(list_folder, path, inode_order)
+        except Exception as e:
+            if guard is None:
+                raise
+            guard.skip(path, e)
+            node.incomplete = True
+            return []
+        for name, st in files:
+            for metric in metrics:
+                metric.file(node, path, name, st, own)
+        return [name for name, ino in folders]
+
+    def fold(path, node):
+        # Scan a folder and everything below it into the totals of node, without nodes
+        node.collapsed = True
+        todo = [path]
+        while todo:
+            path = todo.pop()
+            node.folderCount += 1
+            todo.extend(os.path.join(path, name) for name in visit(path, node, own=False))
+
+    directory = os.path.realpath(directory)
+    root = new_node(directory)
+    # Depth first, without recursion: stack of (path, node, iterator over the subfolder names, depth)
+    stack = [(directory, root, iter(visit(directory, root)), 0)]
+    count = 1
+    while stack:
+        path, node, todo, depth = stack[-1]
+        name = next(todo, None)
+        if name is not None:
+            subpath = os.path.join(path, name)
+            if keep_depth is not None and depth >= keep_depth:
+                fold(subpath, node)
+                continue
+            sub = node._subnodes[name] = new_node(name)
+            if feedback and count % 100 == 0:
+                feedback.write(('scanning %s' % subpath).ljust(terminal_width)[:terminal_width] + '\r')
+            count += 1
+            stack.append((subpath, sub, iter(visit(subpath, sub)), depth + 1))
+            continue
+        # Folder finished: its totals are final
+        stack.pop()
+        if writer and (max_depth is None or depth <= max_depth):
+            writer.write_node(path, depth, node)
+        if not stack:
+            break
+        parent = stack[-1][1]
+        for metric in metrics:
+            metric.roll_up(parent, node)
+        parent.folderCount += node.folderCount + 1
+        if node.incomplete:
+            parent.incomplete = True
+        if writer:
+            del parent._subnodes[node.name]  # already streamed out
+        elif fold_size is not None and node.size < fold_size:
+            node.collapse()
+    if feedback:
+        feedback.write(' ' * terminal_width + '\r')
+    return root
@@ -0,0 +1,90 @@
+'''
+Compact log2 file size histogram, shared by the duviz and du scanners.
+
+Bucket i holds the files whose size has bit length i, that is bucket 0
+holds empty files and bucket i > 0 holds sizes in [2**(i-1), 2**i).
+For every bucket both the number of files and their total bytes are kept.
+'''
+
+
+class SizeHistogram(object):
+    __slots__ = ('counts', 'bytes')
+
+    def __init__(self):
+        # Grown on demand: most folders only reach a dozen or so buckets.
+        self.counts = []
+        self.bytes = []
+
+    def _grow(self, length):
+        extra = [0] * (length - len(self.counts))
+        self.counts.extend(extra)
+        self.bytes.extend(extra)
+
+    def add(self, size):
+        '''
+        Add a single file to the histogram.
+        @param size: size of the file in bytes.
+        '''
+        bucket = size.bit_length()
+        if bucket >= len(self.counts):
+            self._grow(bucket + 1)
+        self.counts[bucket] += 1
+        self.bytes[bucket] += size
+
+    def merge(self, other):
+        '''Add the buckets of another histogram to this one (roll-up).'''
+        if len(other.counts) > len(self.counts):
+            self._grow(len(other.counts))
+        counts = self.counts
+        sizes = self.bytes
+        for i, count in enumerate(other.counts):
+            if count:
+                counts[i] += count
+                sizes[i] += other.bytes[i]
+
+    def total_count(self):
+        return sum(self.counts)
+
+    def total_bytes(self):
+        return sum(self.bytes)
+
+    def encode(self):
+        '''
+        Serialize to a compact string: "count:bytes" per bucket, separated by commas.
+        Empty trailing buckets are not stored.
+        '''
+        return ','.join('%d:%d' % (c, b) for c, b in zip(self.counts, self.bytes))
+
+    @classmethod
+    def decode(cls, text):
+        '''Inverse of encode().'''
+        hist = cls()
+        if text:
+            for item in text.split(','):
+                count, size = item.split(':')
+                hist.counts.append(int(count))
+                hist.bytes.append(int(size))
+        return hist
+
+    def render(self, size_renderer=str):
+        '''
+        Render the non-empty buckets as "<lower bound>:<count>(<bytes>)" items,
+        e.g. "0:2(0) 1K:10(14.20KiB) 1M:1(1.50MiB)".
+        '''
+        items = []
+        for bucket, count in enumerate(self.counts):
+            if count:
+                items.append('{0}:{1}({2})'.format(bucket_label(bucket), count, size_renderer(self.bytes[bucket])))
+        return ' '.join(items)
+
+
+def bucket_label(bucket):
+    '''Short label for the lower bound of a bucket: 0, 1, 2, 4, ... 512, 1K, 2K, ... 1M, ...'''
+    if bucket == 0:
+        return '0'
+    low = 1 << (bucket - 1)
+    for unit in ['', 'K', 'M', 'G', 'T', 'P']:
+        if low < 1024:
+            return '%d%s' % (low, unit)
+        low >>= 10
+    return '%dE' % low
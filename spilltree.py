@@ -0,0 +1,106 @@
+'''
+Out-of-core DirectoryTree building for trees with more folders than fit in memory.
+
+The du lines (see du.folder_line) are collected in memory up to a budget of
+records, then sorted on their path and spilled to a temporary file (a "run").
+Afterwards the runs are merged: sorting on the list of path components puts
+every folder right before its subfolders (pre-order), so one pass with a stack
+of the open ancestors can do the DirectoryTree.Accum roll-up: a folder is
+finished (post-order) as soon as a path outside of it comes by.
+
+Only the nodes down to maxlevel are kept, so at most the display levels plus
+one path of open ancestors are in memory at any time.
+'''
+
+import heapq
+import tempfile
+
+from DirectoryTree import DirectoryTree
+from scanengine import path_split
+
+# Path components are joined with NUL for the sort key: NUL sorts before any
+# other character, which makes the string order equal to the component order.
+SEP = '\0'
+
+
+def _sort_key(line, base):
+    path = line.rsplit('|', 1)[-1]
+    return SEP.join(path_split(path, base=base)[1:])
+
+
+def _spill(records):
+    # Write a sorted run to a temporary file, one "key NUL line" per line.
+    records.sort()
+    run = tempfile.TemporaryFile('w+', encoding='utf-8', errors='surrogateescape')
+    run.writelines(key + SEP + line + '\n' for key, line in records)
+    run.seek(0)
+    return run
+
+
+def _split_entry(entry):
+    # The key itself contains NULs: the line is what follows the last one.
+    key, _, line = entry[:-1].rpartition(SEP)
+    return key, line
+
+
+def sorted_records(lines, base, budget):
+    '''
+    External sort of du lines on their path (relative to base).
+    @param budget maximum number of records held in memory
+    @return generator of (key, line) in sorted order
+    '''
+    runs = []
+    records = []
+    try:
+        for line in lines:
+            records.append((_sort_key(line, base), line))
+            if len(records) >= budget:
+                runs.append(_spill(records))
+                records = []
+        records.sort()
+        for record in heapq.merge(records, *[(_split_entry(e) for e in run) for run in runs]):
+            yield record
+    finally:
+        for run in runs:
+            run.close()
+
+
+def build_tree_spilled(lines, root, budget=100000, maxlevel=1):
+    '''
+    Build an accumulated DirectoryTree from du lines with bounded memory.
+
+    @param lines iterable of du lines (e.g. du.iter_du_tree(root))
+    @param root the scanned (real) path
+    @param budget maximum number of folder records held in memory before spilling
+    @param maxlevel depth of the nodes to keep (the root is level 0)
+    @return DirectoryTree, already accumulated: do not call Accum() on it
+    '''
+    tree = DirectoryTree(root)
+    # Stack of open folders: (path components, node)
+    stack = [((), tree)]
+
+    def finish():
+        components, node = stack.pop()
+        parent = stack[-1][1]
+        parent.AddTotals(node)
+        if len(components) <= maxlevel:
+            parent.subnodes[components[-1]] = node
+
+    for key, line in sorted_records(lines, root, budget):
+        components = tuple(key.split(SEP)) if key else ()
+        # Close the folders that are not an ancestor of this one
+        while stack[-1][0] != components[:len(stack[-1][0])]:
+            finish()
+        # Open missing intermediate folders (no du line of their own)
+        for depth in range(len(stack[-1][0]) + 1, len(components)):
+            stack.append((components[:depth], DirectoryTree(components[depth - 1])))
+        if components:
+            node = DirectoryTree(components[-1])
+            stack.append((components, node))
+        else:
+            node = tree
+        node.SetFolder(line.split('|'))
+
+    while len(stack) > 1:
+        finish()
+    return tree
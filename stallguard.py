@@ -0,0 +1,144 @@
+'''
+Stall-resistant scanning: run blocking file system calls in watchdog
+supervised worker threads, with a timeout and bounded retries.
+
+A hung network mount (NFS, CIFS, ...) makes os.listdir() or os.stat() block
+forever. With a StallGuard the scanner only waits for a while: a directory
+that does not respond (or can not be read at all) is recorded as skipped,
+its node is marked incomplete and the scan carries on with the rest.
+
+A worker that stays stuck in the kernel can not be cancelled: it is left
+behind (as a daemon thread, so it does not keep the process alive) and a
+fresh worker takes over. The number of such hung workers is bounded, once
+the bound is reached all further calls fail immediately.
+'''
+
+import errno
+import queue
+import threading
+import time
+
+# Errors that may go away when trying again (e.g. a flaky network mount).
+TRANSIENT_ERRNOS = frozenset([errno.EAGAIN, errno.EINTR, errno.EIO, errno.ESTALE, errno.ETIMEDOUT])
+
+
+class StallError(Exception):
+    '''A call did not finish within the timeout, for every attempt.'''
+
+    def __init__(self, message, seconds=0.0, attempts=0):
+        Exception.__init__(self, message)
+        self.seconds = seconds
+        self.attempts = attempts
+
+
+class _Job(object):
+    __slots__ = ['function', 'args', 'result', 'error', 'done', 'abandoned']
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.abandoned = False
+
+
+class StallGuard(object):
+    '''
+    Watchdog for blocking file system calls.
+
+    @param timeout seconds to wait for one attempt
+    @param retries number of extra attempts after a timeout or transient error
+    @param max_hung maximum number of workers left behind in hung calls
+    '''
+
+    def __init__(self, timeout=10.0, retries=2, max_hung=16):
+        self.timeout = timeout
+        self.retries = retries
+        self.max_hung = max_hung
+        self.hung = 0
+        # Skipped subtrees: list of (path, reason, seconds stalled)
+        self.skipped = []
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._spawn()
+
+    def _spawn(self):
+        worker = threading.Thread(target=self._work, name='stallguard')
+        worker.daemon = True
+        worker.start()
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                job.result = job.function(*job.args)
+            except Exception as e:
+                job.error = e
+            with self._lock:
+                job.done.set()
+                if job.abandoned:
+                    # Came back from a hung call: a replacement worker took over.
+                    self.hung -= 1
+                    return
+
+    def _attempt(self, function, args):
+        # @return the finished job (result or error), None on timeout
+        job = _Job(function, args)
+        self._jobs.put(job)
+        if not job.done.wait(self.timeout):
+            with self._lock:
+                if not job.done.is_set():
+                    job.abandoned = True
+                    self.hung += 1
+                    self._spawn()
+                    return None
+        return job
+
+    def call(self, function, *args):
+        '''
+        Call function(*args) in a worker thread.
+
+        @return the result of the call
+        @raise StallError if every attempt timed out (or too many workers hang)
+        @raise the exception of the call (after retrying transient errors)
+        '''
+        stalled = 0.0
+        for attempt in range(1, self.retries + 2):
+            if self.hung >= self.max_hung:
+                raise StallError('too many hung workers', stalled, attempt - 1)
+            start = time.time()
+            job = self._attempt(function, args)
+            if job is None:
+                stalled += time.time() - start
+                continue
+            if job.error is None:
+                return job.result
+            if getattr(job.error, 'errno', None) not in TRANSIENT_ERRNOS or attempt > self.retries:
+                raise job.error
+        raise StallError('no response after %d attempts' % attempt, stalled, attempt)
+
+    def skip(self, path, error):
+        '''Record a skipped subtree.'''
+        if isinstance(error, StallError):
+            reason = 'stalled, %s' % error
+            seconds = error.seconds
+        else:
+            reason = getattr(error, 'strerror', None) or str(error)
+            seconds = 0.0
+        self.skipped.append((path, reason, seconds))
+
+    def report(self):
+        '''
+        @return list of report lines on the skipped subtrees
+        '''
+        if not self.skipped:
+            return []
+        stalled = sum(seconds for path, reason, seconds in self.skipped)
+        lines = ['Incomplete: {0} subtrees skipped, {1:.1f}s stalled'.format(len(self.skipped), stalled)]
+        for path, reason, seconds in self.skipped:
+            if seconds:
+                lines.append('  {0}: {1} ({2:.1f}s)'.format(path, reason, seconds))
+            else:
+                lines.append('  {0}: {1}'.format(path, reason))
+        return lines
@@ -3,19 +3,46 @@
 
 #!/usr/bin/env python
 import os
-import shlex
-import struct
-import platform
-import subprocess
  
  
 def get_terminal_size():
     """ getTerminalSize()
      - get width and height of console
      - works on linux,os x,windows,cygwin(windows)
+     In-process only (COLUMNS/LINES or os.get_terminal_size()), the legacy
+     probes below are only used on interpreters without os.get_terminal_size().
      originally retrieved from:
      http://stackoverflow.com/questions/566746/how-to-get-console-window-width-in-python
     """
+    tuple_xy = _get_terminal_size_os()
+    if tuple_xy is not None:
+        return tuple_xy
+    return _get_terminal_size_legacy()
+
+
+def _get_terminal_size_os():
+    # Same lookup order as shutil.get_terminal_size(), without importing shutil.
+    try:
+        columns = int(os.environ['COLUMNS'])
+        lines = int(os.environ['LINES'])
+        if columns > 0 and lines > 0:
+            return columns, lines
+    except (KeyError, ValueError):
+        pass
+    if not hasattr(os, 'get_terminal_size'):
+        return None
+    for fd in (1, 2, 0):
+        try:
+            size = os.get_terminal_size(fd)
+        except (ValueError, OSError):
+            continue
+        if size.columns > 0 and size.lines > 0:
+            return size.columns, size.lines
+    return (80, 25)      # default value
+
+
+def _get_terminal_size_legacy():
+    import platform
     current_os = platform.system()
     tuple_xy = None
     if current_os == 'Windows':
@@ -32,6 +59,7 @@ def get_terminal_size():
  
 def _get_terminal_size_windows():
     try:
+        import struct
         from ctypes import windll, create_string_buffer
         # stdin handle is -10
         # stdout handle is -11
@@ -54,6 +82,8 @@ def _get_terminal_size_tput():
     # get terminal width
     # src: http://stackoverflow.com/questions/263890/how-do-i-find-the-width-height-of-a-terminal-window
     try:
+        import shlex
+        import subprocess
         cols = int(subprocess.check_call(shlex.split('tput cols')))
         rows = int(subprocess.check_call(shlex.split('tput lines')))
         return (cols, rows)
@@ -62,6 +92,8 @@ def _get_terminal_size_tput():
  
  
 def _get_terminal_size_linux():
+    import struct
+
     def ioctl_GWINSZ(fd):
         try:
             import fcntl
@@ -1,10 +1,30 @@
 
+import io
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
 import unittest
-import StringIO
 import textwrap
 
 
+import dedup
+import distscan
+import du
 import duviz
+import duvizd
+import history
+import scanengine
+import spilltree
+import stallguard
+import treeformat
+import treemap
+import treequery
+import watch
 
 
 class BarTest(unittest.TestCase):
@@ -111,11 +131,880 @@ class PathSplitTest(unittest.TestCase):
             self.assertEqual(expected, duviz.path_split(input, base))
 
 
+class SizeHistogramTest(unittest.TestCase):
+
+    def setUp(self):
+        duviz.getClusterSize()
+
+    def test_buckets(self):
+        node = duviz.DirectoryTreeNode('root')
+        node.import_path('root', 0)
+        for size in [0, 1, 3, 1000, 1024, 1500]:
+            node.AddFile('f', size)
+        self.assertEqual([1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 1, 2], node.sizeHist.counts)
+        self.assertEqual(3, node.sizeHist.bytes[2])
+        self.assertEqual(2524, node.sizeHist.bytes[11])
+        self.assertEqual('0:1(0B) 1:1(1B) 2:1(3B) 512:1(1000B) 1K:2(2.46KiB)', node.sizeHist.render(duviz.human_readable_byte_size))
+
+    def test_roll_up(self):
+        tree = duviz.DirectoryTreeNode('root')
+        top = tree.import_path('root', 0)
+        sub = tree.import_path('root/sub', 0)
+        sub.AddFile('a', 100)
+        sub.AddFile('b', 5000000)
+        top.AddFile('c', 120)
+        top.AddDir(sub)
+        self.assertEqual(3, top.sizeHist.total_count())
+        self.assertEqual(5000220, top.sizeHist.total_bytes())
+        self.assertEqual([0, 0, 0, 0, 0, 0, 0, 2], top.sizeHist.counts[:8])
+
+    def test_encode_decode(self):
+        node = duviz.DirectoryTreeNode('root')
+        node.import_path('root', 0)
+        for size in [0, 7, 7, 300]:
+            node.AddFile('f', size)
+        text = node.sizeHist.encode()
+        self.assertEqual('1:0,0:0,0:0,2:14,0:0,0:0,0:0,0:0,0:0,1:300', text)
+        copy = duviz.SizeHistogram.decode(text)
+        self.assertEqual(node.sizeHist.counts, copy.counts)
+        self.assertEqual(node.sizeHist.bytes, copy.bytes)
+
+
+class ExtensionTableTest(unittest.TestCase):
+
+    def test_file_extension(self):
+        self.assertEqual('.txt', duviz.file_extension('a.TXT'))
+        self.assertEqual('.gz', duviz.file_extension('a.tar.gz'))
+        self.assertEqual('', duviz.file_extension('Makefile'))
+        self.assertTrue(duviz.file_extension('x.py') is duviz.file_extension('y.PY'))
+
+    def test_subtree_table(self):
+        tree = duviz.DirectoryTreeNode('root')
+        top = tree.import_path('root', 0)
+        sub = tree.import_path('root/sub', 0)
+        top.extTable = duviz.ExtensionTable()
+        sub.extTable = duviz.ExtensionTable()
+        top.extTable.add('.txt', 10)
+        sub.extTable.add('.txt', 5)
+        sub.extTable.add('.jpg', 1000)
+        self.assertEqual([('.jpg', 1, 1000), ('.txt', 1, 5)], sub.ext_table().sorted_rows())
+        self.assertEqual([('.jpg', 1, 1000), ('.txt', 2, 15)], top.ext_table().sorted_rows())
+        self.assertEqual([('.jpg', 1, 1000)], top.ext_table().sorted_rows(top=1))
+
+    def test_report(self):
+        table = duviz.ExtensionTable()
+        table.add(('', 0), 2048)
+        table.add(('.c', 1000), 10)
+        self.assertEqual(['   2.00KiB        1 (none) uid=0', '       10B        1 .c uid=1000'], table.report())
+
+
+class TreeFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        duviz.getClusterSize()
+        self.tree = duviz.DirectoryTreeNode('root')
+        self.top = top = self.tree.import_path('root', 0)
+        sub = self.tree.import_path('root/sub', 0)
+        sub.AddFile('a.bin', 300)
+        top.AddFile('b,c', 20)
+        top.AddDir(sub)
+
+    def write(self, name, columns=None, max_depth=None):
+        out = io.BytesIO()
+        writer = treeformat.get_writer(name, out, columns)
+        treeformat.write_tree(self.tree, writer, max_depth=max_depth)
+        writer.close()
+        return out.getvalue()
+
+    def test_ndjson(self):
+        result = self.write('ndjson', ['size', 'files'])
+        expected = b'{"path":"root","depth":0,"size":320,"files":2}\n{"path":"root/sub","depth":1,"size":300,"files":1}\n'
+        self.assertEqual(expected, result)
+
+    def test_csv_max_depth(self):
+        result = self.write('csv', ['size', 'largest_name'], max_depth=0)
+        self.assertEqual(b'path,depth,size,largest_name\nroot,0,320,a.bin\n', result)
+
+    def test_undecodable_name(self):
+        # The same \xNN escapes in every format, all valid UTF-8
+        self.top.AddFile(b'caf\xe9.txt'.decode('utf-8', 'surrogateescape'), 400)
+        sub = self.top._subnodes['sub']
+        sub.name = b'\xff'.decode('utf-8', 'surrogateescape')
+        self.top._subnodes = {sub.name: sub}
+        self.assertEqual(b'path,depth,largest_name\nroot,0,caf\\xe9.txt\nroot/\\xff,1,a.bin\n', self.write('csv', ['largest_name']))
+        lines = self.write('ndjson', ['largest_name']).decode('utf-8').splitlines()
+        self.assertEqual([{'path': 'root', 'depth': 0, 'largest_name': 'caf\\xe9.txt'},
+                          {'path': 'root/\\xff', 'depth': 1, 'largest_name': 'a.bin'}], [json.loads(line) for line in lines])
+        columns, records = treeformat.read_binary(io.BytesIO(self.write('binary', ['largest_name'])))
+        self.assertEqual([('root', 0, ['caf\\xe9.txt']), ('root/\\xff', 1, ['a.bin'])], list(records))
+
+    def test_binary_round_trip(self):
+        data = self.write('binary', ['own_size', 'largest_name'])
+        columns, records = treeformat.read_binary(io.BytesIO(data))
+        self.assertEqual(['own_size', 'largest_name'], columns)
+        self.assertEqual([('root', 0, [20, 'a.bin']), ('root/sub', 1, [300, 'a.bin'])], list(records))
+
+    def test_parse_columns(self):
+        self.assertEqual(['size', 'files'], treeformat.parse_columns('size, files'))
+        self.assertRaises(ValueError, treeformat.parse_columns, 'size,bogus')
+
+
+class DedupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'sub'))
+        data = b'x' * 100000
+        self.write('a', data)
+        self.write('sub/b', data)
+        self.write('sub/c', data[:-1] + b'y')  # same size, same first block
+        self.write('d', b'abc')
+        self.write('sub/e', b'abc')
+        os.link(os.path.join(self.root, 'a'), os.path.join(self.root, 'sub/hardlink'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, data):
+        with open(os.path.join(self.root, name), 'wb') as f:
+            f.write(data)
+
+    def files(self):
+        result = []
+        for root, dirs, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(root, name)
+                result.append((path, os.path.getsize(path)))
+        return result
+
+    def test_find_duplicates(self):
+        groups = dedup.find_duplicates(self.files(), workers=2)
+        self.assertEqual(2, len(groups))
+        self.assertEqual(3, groups[0][0])
+        self.assertEqual([os.path.join(self.root, 'd'), os.path.join(self.root, 'sub/e')], groups[0][1])
+        self.assertEqual(100000, groups[1][0])
+        self.assertEqual(2, len(groups[1][1]))  # hardlink counted once, 'c' differs
+        self.assertEqual(100003, dedup.reclaimable(groups))
+
+    def test_apply_to_tree(self):
+        duviz.getClusterSize()
+        tree = duviz.DirectoryTreeNode(self.root)
+        tree.import_path(self.root, 0)
+        tree.import_path(os.path.join(self.root, 'sub'), 0)
+        dedup.apply_to_tree(tree, [(10, ['/x/keep', os.path.join(self.root, 'sub/dup')])])
+        self.assertEqual(10, tree.dupSize)
+        self.assertEqual(10, tree._subnodes['sub'].dupSize)
+
+
+class TreeWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        duviz.getClusterSize()
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, 'a', 'b'))
+        self.write('a/b/f', 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, size):
+        with open(os.path.join(self.root, name), 'wb') as f:
+            f.write(b'x' * size)
+
+    def test_refresh_propagates_deltas(self):
+        tree = duviz.build_du_tree(self.root, feedback=None)
+        watcher = watch.TreeWatcher(tree, use_inotify=False)
+        self.write('a/b/g', 50)
+        os.mkdir(os.path.join(self.root, 'a', 'new'))
+        self.write('a/new/h', 7)
+        self.assertTrue(watcher.refresh_dir(os.path.join(self.root, 'a', 'b')))
+        self.assertTrue(watcher.refresh_dir(os.path.join(self.root, 'a')))
+        self.assertEqual(157, tree.size)
+        self.assertEqual(3, tree.fileCount)
+        self.assertEqual(150, tree._subnodes['a']._subnodes['b'].size)
+
+        shutil.rmtree(os.path.join(self.root, 'a', 'b'))
+        self.assertTrue(watcher.refresh_dir(os.path.join(self.root, 'a')))
+        self.assertEqual(7, tree.size)
+        self.assertEqual(['new'], list(tree._subnodes['a']._subnodes))
+        self.assertFalse(watcher.refresh_dir(os.path.join(self.root, 'a')))
+        watcher.close()
+
+    def test_polling_notices_files_growing(self):
+        tree = duviz.build_du_tree(self.root, feedback=None)
+        watcher = watch.TreeWatcher(tree, use_inotify=False)
+        self.assertFalse(watcher.update(0))
+        with open(os.path.join(self.root, 'a', 'b', 'f'), 'ab') as f:
+            f.write(b'x' * 20)
+        self.assertTrue(watcher.update(0))
+        self.assertEqual(120, tree.size)
+        self.assertFalse(watcher.update(0))
+        watcher.close()
+
+    def test_busy_directory_does_not_hold_up_updates(self):
+        tree = duviz.build_du_tree(self.root, feedback=None)
+        watcher = watch.TreeWatcher(tree)
+        if watcher.inotify is None:
+            watcher.close()
+            self.skipTest('inotify not available')
+        stop = threading.Event()
+        def writer():
+            # Appends every 10ms, for 5s at most
+            with open(os.path.join(self.root, 'a', 'b', 'f'), 'ab') as f:
+                for i in range(500):
+                    if stop.wait(0.01):
+                        break
+                    f.write(b'x')
+                    f.flush()
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            start = time.time()
+            self.assertTrue(watcher.update(1.0))
+            self.assertTrue(time.time() - start < watch.COALESCE_TIME + 1.0)
+        finally:
+            stop.set()
+            thread.join()
+            watcher.close()
+
+
+class FoldedBuildDuTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        duviz.getClusterSize()
+        self.root = tempfile.mkdtemp()
+        for d in ['a/b/c', 'a/d', 'e']:
+            os.makedirs(os.path.join(self.root, d))
+        for name, size in [('x', 10), ('a/y', 20), ('a/b/z', 30), ('a/b/c/big', 400), ('a/d/w', 5), ('e/v', 1)]:
+            with open(os.path.join(self.root, name), 'wb') as f:
+                f.write(b'.' * size)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def assertSameTotals(self, tree):
+        self.assertEqual(466, tree.size)
+        self.assertEqual(6, tree.fileCount)
+        self.assertEqual(5, tree.folderCount)
+        self.assertEqual('big', tree.largestFileName)
+        self.assertEqual(6, tree.sizeHist.total_count())
+
+    def test_keep_depth(self):
+        tree = duviz.build_du_tree(self.root, feedback=None, keep_depth=1)
+        self.assertSameTotals(tree)
+        a = tree._subnodes['a']
+        self.assertEqual({}, a._subnodes)
+        self.assertTrue(a.collapsed)
+        self.assertEqual(20, a.mySize)
+        self.assertEqual(455, a.size)
+        self.assertEqual(3, a.folderCount)
+        self.assertFalse(tree._subnodes['e'].collapsed)
+
+    def test_fold_size(self):
+        tree = duviz.build_du_tree(self.root, feedback=None, fold_size=450, extensions=True)
+        self.assertSameTotals(tree)
+        a = tree._subnodes['a']
+        self.assertEqual(['b', 'd'], sorted(a._subnodes))
+        self.assertFalse(a.collapsed)
+        b = a._subnodes['b']
+        self.assertTrue(b.collapsed)
+        self.assertEqual({}, b._subnodes)
+        self.assertEqual(430, b.size)
+        self.assertEqual([('', 2, 430)], b.ext_table().sorted_rows())
+        self.assertEqual(6, tree.ext_table().sorted_rows()[0][1])
+
+    def test_fold_size_as_children_finish(self):
+        # Small folders are folded as soon as they are finished, not when their parent is
+        for i in range(10):
+            os.makedirs(os.path.join(self.root, 'e', 'many', 'f%d' % i, 'g', 'h'))
+        nodes = []
+        peak = [0]
+        class Peak(scanengine.Metric):
+            def start(self, node):
+                nodes.append(node)
+            def folder(self, node, path, own=True):
+                todo = [nodes[0]]
+                count = 0
+                while todo:
+                    count += 1
+                    todo.extend(todo.pop()._subnodes.values())
+                peak[0] = max(peak[0], count)
+        tree = scanengine.scan(self.root, ['bytes', Peak()], fold_size=450)
+        self.assertEqual(36, tree.folderCount)
+        self.assertEqual({}, tree._subnodes['e']._subnodes)
+        # The 30 folders below e/many are never in memory at the same time
+        self.assertTrue(peak[0] <= 20, peak[0])
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.tree = os.path.join(self.root, 'tree')
+        for d in ['a/b', 'a/c', 'd', 'e/f/g']:
+            os.makedirs(os.path.join(self.tree, d))
+            with open(os.path.join(self.tree, d, 'file'), 'wb') as f:
+                f.write(b'x' * len(d))
+        self.journal = os.path.join(self.root, 'journal')
+        self.folder_line = du.folder_line
+
+    def tearDown(self):
+        du.folder_line = self.folder_line
+        shutil.rmtree(self.root)
+
+    def interrupt_after(self, count):
+        scanned = []
+        def folder_line(root, files):
+            if len(scanned) == count:
+                raise KeyboardInterrupt()
+            scanned.append(root)
+            return self.folder_line(root, files)
+        du.folder_line = folder_line
+        return scanned
+
+    def test_resume(self):
+        expected = sorted(du.build_du_tree(self.tree))
+        self.interrupt_after(4)
+        self.assertRaises(KeyboardInterrupt, du.build_du_tree, self.tree, checkpoint=self.journal)
+
+        scanned = self.interrupt_after(-1)
+        result = du.build_du_tree(self.tree, checkpoint=self.journal, resume=True)
+        self.assertEqual(expected, sorted(result))
+        self.assertEqual(len(expected) - 4, len(scanned))
+
+        # A completed scan is not repeated at all.
+        scanned = self.interrupt_after(-1)
+        result = du.build_du_tree(self.tree, inode_order=True, checkpoint=self.journal, resume=True)
+        self.assertEqual(expected, sorted(result))
+        self.assertEqual([], scanned)
+
+    def test_streamed(self):
+        # With a journal too, lines come out while scanning (e.g. for duviz2 --memory-budget)
+        scanned = self.interrupt_after(-1)
+        lines = du.iter_du_tree(self.tree, checkpoint=self.journal)
+        self.assertTrue(next(lines).endswith('|' + self.tree))
+        self.assertEqual(1, len(scanned))
+        tree = spilltree.build_tree_spilled(lines, self.tree, budget=2, maxlevel=1)
+        self.assertEqual(7, tree.totFold)
+        self.assertEqual(8, len(scanned))
+        # All recorded in the journal
+        scanned = self.interrupt_after(-1)
+        self.assertEqual(8, len(du.build_du_tree(self.tree, checkpoint=self.journal, resume=True)))
+        self.assertEqual([], scanned)
+
+    def test_torn_journal(self):
+        with open(self.journal, 'w') as f:
+            f.write('C|' + self.tree + '/d\nF|1|2|2|x|2|x|0|0:0|' + self.tree)
+        records, complete = du.Journal(self.journal).load()
+        self.assertEqual({}, records)
+        self.assertEqual(set([self.tree + '/d']), complete)
+
+    def test_resume_torn_journal(self):
+        expected = sorted(du.build_du_tree(self.tree))
+        self.interrupt_after(4)
+        self.assertRaises(KeyboardInterrupt, du.build_du_tree, self.tree, checkpoint=self.journal)
+        # Tear the last entry (a folder line) in the middle
+        with open(self.journal, 'rb') as f:
+            data = f.read()
+        with open(self.journal, 'wb') as f:
+            f.write(data[:data.rindex(b'F|') + 5])
+
+        self.interrupt_after(2)
+        self.assertRaises(KeyboardInterrupt, du.build_du_tree, self.tree, checkpoint=self.journal, resume=True)
+        self.interrupt_after(-1)
+        self.assertEqual(expected, sorted(du.build_du_tree(self.tree, checkpoint=self.journal, resume=True)))
+        with open(self.journal, 'rb') as f:
+            self.assertTrue(all(line[:2] in (b'F|', b'C|') for line in f))
+
+
+class SpillTreeTest(unittest.TestCase):
+
+    lines = [
+        '1|10|10|x|10|x|5|0:0,0:0,0:0,0:0,1:10|/r',
+        '2|300|300|big|200|y|3|0:0,0:0,0:0,0:0,0:0,0:0,0:0,1:100,1:200|/r/a',
+        '1|7|7|z|7|z|4|0:0,0:0,0:0,1:7|/r/a/b',
+        '1|5|5|w|5|w|1|0:0,0:0,0:0,1:5|/r/a/b/c',
+        '1|1|1|v|1|v|9|0:0,1:1|/r/a-b',
+        '0|0|0||0||||/r/a.b/d',
+    ]
+
+    def test_same_as_accum(self):
+        expected = duviz2_tree(self.lines)
+        for budget in [1, 2, 100]:
+            tree = spilltree.build_tree_spilled(reversed(self.lines), '/r', budget=budget, maxlevel=1)
+            for attr in ['totSize', 'totAlloc', 'totCount', 'totFold', 'maxFileName', 'oldFileDate', 'oldFileName']:
+                self.assertEqual(getattr(expected, attr), getattr(tree, attr))
+            self.assertEqual(expected.sizeHist.counts, tree.sizeHist.counts)
+            self.assertEqual(['a', 'a-b', 'a.b'], sorted(tree.subnodes))
+            a = tree.subnodes['a']
+            self.assertEqual((312, 3, {}), (a.totSize, a.totFold, a.subnodes))
+            self.assertEqual(1, tree.subnodes['a.b'].totFold)
+
+    def test_empty_folder_has_no_date(self):
+        tree = duviz2_tree(self.lines)
+        self.assertEqual((1, 'w'), (tree.oldFileDate, tree.oldFileName))
+        self.assertEqual(None, tree.subnodes['a.b'].oldFileDate)
+        empty = tempfile.mkdtemp()
+        try:
+            self.assertEqual('0|0|0||0||||' + empty, du.folder_line(empty, []))
+        finally:
+            os.rmdir(empty)
+
+
+def duviz2_tree(lines):
+    from DirectoryTree import DirectoryTree
+    tree = DirectoryTree('/r')
+    for line in lines:
+        tree.AddFolder(line)
+    tree.Accum()
+    return tree
+
+
+class StallGuardTest(unittest.TestCase):
+
+    def setUp(self):
+        duviz.getClusterSize()
+        self.root = tempfile.mkdtemp()
+        for d in ['a', 'slow/deeper']:
+            os.makedirs(os.path.join(self.root, d))
+        for name, size in [('x', 10), ('a/y', 20), ('slow/z', 30)]:
+            with open(os.path.join(self.root, name), 'wb') as f:
+                f.write(b'.' * size)
+        os.symlink('nowhere', os.path.join(self.root, 'a', 'dangling'))
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        shutil.rmtree(self.root)
+
+    def test_timeout(self):
+        guard = stallguard.StallGuard(timeout=0.02, retries=1)
+        self.assertRaises(stallguard.StallError, guard.call, self.release.wait)
+        self.assertEqual(2, guard.hung)
+        self.assertEqual(3, guard.call(len, 'abc'))
+        self.release.set()
+        self.assertRaises(OSError, guard.call, os.listdir, os.path.join(self.root, 'missing'))
+
+    def test_list_folder(self):
+        os.mkfifo(os.path.join(self.root, 'a', 'fifo'))
+        os.symlink(self.root, os.path.join(self.root, 'a', 'loop'))
+        files, folders = scanengine.list_folder(os.path.join(self.root, 'a'))
+        files = dict(files)
+        self.assertEqual(['dangling', 'fifo', 'y'], sorted(files))
+        self.assertEqual(len('nowhere'), files['dangling'].st_size)
+        self.assertEqual(20, files['y'].st_size)
+        self.assertEqual([], folders)
+
+    def test_skip_stalled(self):
+        self.assertEqual(67, duviz.build_du_tree(self.root, feedback=None).size)
+
+        slow = os.path.join(self.root, 'slow')
+        def list_folder(directory, inode_order=False):
+            if directory == slow:
+                self.release.wait()
+            return original(directory, inode_order)
+        original = scanengine.list_folder
+        scanengine.list_folder = list_folder
+        try:
+            guard = stallguard.StallGuard(timeout=0.02, retries=0)
+            tree = duviz.build_du_tree(self.root, feedback=None, guard=guard)
+        finally:
+            scanengine.list_folder = original
+
+        self.assertEqual(37, tree.size)
+        self.assertTrue(tree.incomplete)
+        self.assertTrue(tree._subnodes['slow'].incomplete)
+        self.assertEqual([], list(tree._subnodes['a']._subnodes))
+        self.assertEqual([slow], [path for path, reason, seconds in guard.skipped])
+        self.assertIn('(incomplete)', tree.tree_display())
+        self.assertEqual(2, len(guard.report()))
+
+
+class TreeQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        duviz.getClusterSize()
+        tree = duviz.DirectoryTreeNode('/r')
+        for path, size in [('/r', 4000), ('/r/a', 3000), ('/r/a/b', 2048), ('/r/a/c', 100), ('/r/d', 500)]:
+            tree.import_path(path, size)
+        self.index = treequery.TreeIndex(tree)
+
+    def test_parse_size(self):
+        self.assertEqual(1500, treequery.parse_size('1500'))
+        self.assertEqual(100 << 30, treequery.parse_size('100G'))
+        self.assertEqual(3 << 19, treequery.parse_size('1.5MiB'))
+        self.assertRaises(ValueError, treequery.parse_size, 'lots')
+
+    def test_queries(self):
+        self.assertEqual(5, len(self.index))
+        self.assertEqual(self.index.nodes['/r/a'], self.index.lookup('/r/a'))
+        self.assertEqual(['/r/a/b', '/r/a/c'], [p for p, sub in self.index.children['/r/a']])
+        self.assertEqual([(4000, '/r'), (3000, '/r/a')], self.index.query('size>2K'))
+        self.assertEqual([(2048, '/r/a/b')], self.index.query('size>=2K')[2:])
+        self.assertEqual([(500, '/r/d'), (100, '/r/a/c')], self.index.query('size<1K'))
+        self.assertEqual([(4000, '/r'), (3000, '/r/a'), (2048, '/r/a/b')], self.index.query('top=3'))
+        self.assertEqual([(4000, '/r'), (3000, '/r/a'), (500, '/r/d')], self.index.query('path=/r'))
+        self.assertRaises(KeyError, self.index.query, 'path=/elsewhere')
+        self.assertRaises(ValueError, self.index.query, 'name=x')
+
+    def test_directory_tree(self):
+        index = treequery.TreeIndex(duviz2_tree(SpillTreeTest.lines))
+        self.assertEqual([(323, '/r'), (312, '/r/a')], index.top(2))
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        duviz.getClusterSize()
+        self.root = tempfile.mkdtemp()
+        for d in ['one/sub', 'two']:
+            os.makedirs(os.path.join(self.root, d))
+        for name, size in [('one/x', 10), ('one/sub/y', 200), ('two/z', 30)]:
+            self.write(name, size)
+        self.one = os.path.join(self.root, 'one')
+        self.two = os.path.join(self.root, 'two')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, size):
+        with open(os.path.join(self.root, name), 'wb') as f:
+            f.write(b'.' * size)
+
+    def test_cache(self):
+        cache = duvizd.TreeCache(max_roots=1, use_inotify=False)
+        self.assertEqual([(210, self.one), (200, os.path.join(self.one, 'sub'))], cache.handle({'op': 'subtree', 'path': self.one}))
+        self.assertEqual([(200, os.path.join(self.one, 'sub'))], cache.handle({'op': 'top', 'path': os.path.join(self.one, 'sub'), 'n': 5}))
+        self.assertEqual([self.one], [root.path for root in cache.roots()])
+        self.assertTrue(cache.handle({'op': 'render', 'path': os.path.join(self.one, 'sub')}).startswith('+'))
+
+        self.write('one/sub/new', 1000)
+        self.assertEqual(1, cache.refresh_stale())
+        self.assertEqual([(1210, self.one)], cache.handle({'op': 'query', 'path': self.one, 'query': 'size>1200'}))
+
+        # Least recently used root is dropped
+        self.assertIn(self.two, cache.handle({'op': 'render', 'path': self.two}))
+        self.assertEqual([self.two], [root.path for root in cache.roots()])
+        self.assertRaises(duvizd.DaemonError, cache.handle, {'op': 'top', 'path': 'relative'})
+        self.assertRaises(KeyError, cache.handle, {'op': 'subtree', 'path': os.path.join(self.two, 'missing')})
+
+    def test_scanning(self):
+        cache = duvizd.TreeCache(use_inotify=False, scan_wait=0)
+        build = duviz.build_du_tree
+        go = threading.Event()
+        def slow_build(*args, **kwargs):
+            go.wait(10)
+            return build(*args, **kwargs)
+        duviz.build_du_tree = slow_build
+        try:
+            self.assertRaises(duvizd.DaemonScanning, cache.handle, {'op': 'top', 'path': self.one})
+            self.assertRaises(duvizd.DaemonScanning, cache.handle, {'op': 'subtree', 'path': os.path.join(self.one, 'sub')})
+        finally:
+            go.set()
+            duviz.build_du_tree = build
+        cache.root(self.one, wait=10)
+        self.assertEqual([(210, self.one)], cache.handle({'op': 'top', 'path': self.one, 'n': 1}))
+        # Failed scans are not cached
+        cache.scan_wait = 10
+        self.assertRaises(OSError, cache.handle, {'op': 'top', 'path': os.path.join(self.root, 'missing')})
+        self.assertEqual([self.one], [root.path for root in cache.roots()])
+
+    def test_cli_falls_back_while_scanning(self):
+        socket_path = os.path.join(self.root, 'duviz.sock')
+        cache = duvizd.TreeCache(use_inotify=False, scan_wait=0)
+        cache.root(self.two, wait=10)
+        server = duvizd.DaemonServer(socket_path, cache, interval=60)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        build = duviz.build_du_tree
+        go = threading.Event()
+        def slow_build(*args, **kwargs):
+            go.wait(10)
+            return build(*args, **kwargs)
+        duviz.build_du_tree = slow_build
+        clioptions, cliargs = duviz.parse_cli([])
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = io.StringIO(), io.StringIO()
+        try:
+            # Still scanning: left for a local scan. Not in the tree: failed.
+            result = duviz.show_from_daemon(socket_path, [self.one, self.two, os.path.join(self.two, 'missing')], clioptions)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            go.set()
+            duviz.build_du_tree = build
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.assertEqual(([self.one], False), result)
+        self.assertIn(self.two, output)
+
+    def test_socket(self):
+        socket_path = os.path.join(self.root, 'duviz.sock')
+        server = duvizd.DaemonServer(socket_path, duvizd.TreeCache(use_inotify=False), interval=60)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            self.assertEqual([[30, self.two]], duvizd.request(socket_path, op='top', path=self.two, n=1))
+            self.assertRaises(duvizd.DaemonError, duvizd.request, socket_path, op='query', path=self.two, query='bad')
+            self.assertRaises(duvizd.DaemonError, duvizd.DaemonServer, socket_path, duvizd.TreeCache())
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.assertFalse(os.path.exists(socket_path))
+        self.assertRaises(OSError, duvizd.request, socket_path, op='ping')
+
+
+class HistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = history.History(':memory:')
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_record_and_growth(self):
+        lines = SpillTreeTest.lines
+        self.assertEqual((1, 7), self.db.record(duviz2_tree(lines), '/r', taken=1000))
+        self.assertEqual((2, 0), self.db.record(duviz2_tree(lines), '/r', taken=2000))
+        # /r/a/b grows, /r/a/b/c is removed: only the changed folders are stored
+        grown = [lines[0], lines[1], '1|1007|7|z|7|z|4||/r/a/b', lines[4], lines[5]]
+        self.assertEqual((3, 4), self.db.record(duviz2_tree(grown), '/r', taken=3000))
+
+        self.assertEqual([('/r', 323, 1318, 6, 5), ('/r/a', 312, 1307, 4, 3), ('/r/a/b', 12, 1007, 2, 1)],
+                         self.db.growth('/r', since=2500))
+        self.assertEqual([('/r/a/b', 12, 1007, 2, 1)], self.db.growth('/r/a/b', since=2500))
+        self.assertEqual(('/r', 0, 1318, 0, 5), self.db.growth('/r', since=500, top=1)[0])
+        self.assertEqual([], self.db.growth('/r', since=3000))
+        self.assertIn('/day', history.growth_report(self.db.growth('/r', since=2500), 7)[0])
+
+
+class DistScanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for d in ['one/a/b', 'one/c', 'two']:
+            os.makedirs(os.path.join(self.root, d))
+        for name, size in [('one/x', 10), ('one/a/b/y', 200), ('one/c/z', 30), ('two/w', 5)]:
+            self.write(name, size)
+        self.coordinator = distscan.Coordinator(('localhost', 0))
+        self.thread = threading.Thread(target=self.coordinator.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.coordinator.shutdown()
+        self.coordinator.server_close()
+        self.thread.join()
+        shutil.rmtree(self.root)
+
+    def write(self, name, size):
+        with open(os.path.join(self.root, name), 'wb') as f:
+            f.write(b'.' * size)
+
+    def test_merge_and_deltas(self):
+        address = self.coordinator.server_address
+        one = distscan.Agent(address, os.path.join(self.root, 'one'), name='host1')
+        two = distscan.Agent(address, os.path.join(self.root, 'two'), name='host2')
+        self.assertEqual(('FULL', 4), one.push())
+        self.assertEqual(('FULL', 1), two.push())
+        self.assertEqual(('DELTA', 0), one.push())
+
+        self.write('one/a/b/y', 1200)
+        shutil.rmtree(os.path.join(self.root, 'one', 'c'))
+        self.assertEqual(('DELTA', 2), one.push())
+
+        tree = self.coordinator.tree()
+        self.assertEqual(1215, tree.totSize)
+        self.assertEqual(['host1:' + one.root, 'host2:' + two.root], sorted(tree.subnodes))
+        self.assertEqual(1210, tree.subnodes['host1:' + one.root].totSize)
+        self.assertEqual(['a'], list(tree.subnodes['host1:' + one.root].subnodes))
+
+        # A coordinator that lost the state asks for everything again
+        self.coordinator.scans.clear()
+        self.assertEqual(('FULL', 3), one.push())
+
+
+class ScanEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        duviz.getClusterSize()
+        self.root = tempfile.mkdtemp()
+        for d in ['a/b', 'c']:
+            os.makedirs(os.path.join(self.root, d))
+        for name, size, age in [('x', 10, 3000), ('a/y', 20, 1000), ('a/b/z', 300, 2000)]:
+            path = os.path.join(self.root, name)
+            with open(path, 'wb') as f:
+                f.write(b'.' * size)
+            os.utime(path, (age, age))
+        os.link(os.path.join(self.root, 'a', 'y'), os.path.join(self.root, 'c', 'hardlink'))
+        os.symlink('a', os.path.join(self.root, 'dirlink'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_all_metrics(self):
+        tree = scanengine.scan(self.root, ['bytes', 'alloc', 'inodes', 'ages'])
+        self.assertEqual(350, tree.size)
+        self.assertEqual(4, tree.fileCount)
+        self.assertEqual(3, tree.folderCount)
+        self.assertEqual(('z', 300), (tree.largestFileName, tree.largestFileSize))
+        self.assertEqual(4, tree.sizeHist.total_count())
+        # 4 folders, 3 files: the hard link is counted once
+        self.assertEqual(7, tree.inodeCount)
+        self.assertEqual(2, tree.myInodeCount)
+        self.assertEqual(5, tree._subnodes['a'].inodeCount + tree._subnodes['c'].inodeCount)
+        self.assertEqual(1000, tree.oldestFileDate)
+        self.assertIn(tree.oldestFileName, ['y', 'hardlink'])
+        self.assertEqual(('x', 3000), (tree.myOldestFileName, tree.myOldestFileDate))
+        self.assertEqual(['a', 'c'], sorted(tree._subnodes))
+
+    def test_metric_subsets(self):
+        # Every combination works on its own (and with the displays), the other attributes stay at their initial values
+        names = sorted(scanengine.METRICS)
+        expected = {'bytes': ('size', 350), 'alloc': ('allocSize', 350), 'inodes': ('inodeCount', 7), 'ages': ('oldestFileDate', 1000)}
+        for n in range(len(names) + 1):
+            for metrics in itertools.combinations(names, n):
+                tree = scanengine.scan(self.root, metrics)
+                for name, (attribute, value) in expected.items():
+                    self.assertEqual(value if name in metrics else 0, getattr(tree, attribute), (metrics, name))
+                self.assertEqual(3, tree.folderCount)
+                self.assertIn('Inodes:', tree.tree_display(show_hist=True, show_inodes=True, show_ages=True, max_depth=None))
+                tree.block_display(40)
+
+    def test_allocated_size(self):
+        # One definition: the cluster rounded size, in all builders
+        path = os.path.join(self.root, 'c', 'small')
+        with open(path, 'wb') as f:
+            f.write(b'12345')
+        engine = scanengine.scan(self.root, ['bytes', 'alloc', 'inodes'])._subnodes['c']
+        tree = duviz.build_du_tree(self.root, feedback=None)._subnodes['c']
+        line = du.folder_line(os.path.join(self.root, 'c'), scanengine.list_folder(os.path.join(self.root, 'c'))[0])
+        alloc = duviz.AllocatedSize(5) + duviz.AllocatedSize(20)
+        self.assertEqual([alloc] * 3, [engine.myAllocSize, tree.myAllocSize, int(line.split('|')[2])])
+
+    def test_inode_counts(self):
+        # Folders count once, in their own node, hard linked files once
+        tree = scanengine.scan(self.root, ['inodes'])
+        self.assertEqual((2, 7), (tree.myInodeCount, tree.inodeCount))
+        b = tree._subnodes['a']._subnodes['b']
+        self.assertEqual((2, 2), (b.myInodeCount, b.inodeCount))
+        os.link(os.path.join(self.root, 'x'), os.path.join(self.root, 'a', 'b', 'x2'))
+        self.assertEqual(7, scanengine.scan(self.root, ['inodes']).inodeCount)
+
+    def test_build_du_tree_options(self):
+        # Extension table, file list and metrics go through the same scan
+        files = []
+        tree = duviz.build_du_tree(self.root, feedback=None, owners=True, files=files, metrics=['bytes', 'inodes'], inode_order=True)
+        self.assertEqual((350, 0, 7), (tree.size, tree.allocSize, tree.inodeCount))
+        self.assertEqual(4, len(files))
+        self.assertEqual([(('', os.getuid()), 4, 350)], tree.ext_table().sorted_rows())
+
+    def test_parse_metrics(self):
+        self.assertEqual(['bytes', 'inodes'], scanengine.parse_metrics('bytes, inodes'))
+        self.assertRaises(ValueError, scanengine.parse_metrics, 'bytes,colour')
+
+
+class TreemapTest(unittest.TestCase):
+
+    def setUp(self):
+        duviz.getClusterSize()
+        self.tree = duviz.DirectoryTreeNode('/r')
+        # one large folder with a subfolder, and 50 tiny ones
+        for path, size in [('/r', 10000), ('/r/big', 9000), ('/r/big/sub', 4000)] + [('/r/t%02d' % i, 1) for i in range(50)]:
+            self.tree.import_path(path, size)
+        self.out = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out)
+
+    def test_squarify(self):
+        rects = treemap.squarify([6, 6, 4, 3, 2, 2, 1], 0, 0, 6, 4)
+        self.assertEqual(7, len(rects))
+        for area, (x, y, w, h) in zip([6, 6, 4, 3, 2, 2, 1], rects):
+            self.assertAlmostEqual(area, w * h)
+            self.assertTrue(x >= 0 and y >= 0 and x + w <= 6.001 and y + h <= 4.001)
+
+    def test_layout_merges_small_folders(self):
+        tiles, zoomable = treemap.layout(self.tree, 100, 100, min_area=16)
+        self.assertEqual(['/r', 'big', 'sub', '50 smaller folders'], [tile[7] for tile in tiles])
+        self.assertEqual([0, 0, 0, 1], [tile[5] for tile in tiles])
+        self.assertEqual([(1, 'big')], [(index, rel) for index, node, rel in zoomable])
+
+    def test_export(self):
+        self.assertEqual((2, 0), treemap.export(self.tree, self.out, width=100, height=100, min_area=16))
+        with open(os.path.join(self.out, 'index.html')) as f:
+            page = f.read()
+        self.assertIn('<svg id="map"', page)
+        self.assertIn('data-zoom="1"', page)
+        with open(os.path.join(self.out, 'chunks', 'c1.js')) as f:
+            self.assertIn('"path":"/r/big"', f.read())
+        shutil.rmtree(self.out)
+        # Past max_chunks, folders are marked instead of zoomable
+        self.assertEqual((1, 1), treemap.export(self.tree, self.out, width=100, height=100, min_area=16, max_chunks=1))
+        with open(os.path.join(self.out, 'index.html')) as f:
+            page = f.read()
+        self.assertNotIn('data-zoom=', page.split('<script>')[0])
+        self.assertIn('<g class="noview"><title>big', page)
+        self.assertFalse(os.path.exists(os.path.join(self.out, 'chunks', 'c1.js')))
+
+
+class TreeDisplayTest(unittest.TestCase):
+
+    def setUp(self):
+        duviz.getClusterSize()
+        self.tree = duviz.DirectoryTreeNode('/r')
+        for path, size in [('/r', 1000), ('/r/a', 600), ('/r/a/b', 500), ('/r/c', 395), ('/r/tiny', 5)]:
+            self.tree.import_path(path, size)
+
+    def test_one_level(self):
+        lines = self.tree.tree_display(size_renderer=str).split('\n')
+        self.assertEqual(['+1000 (1000): /r', '|', '`-  600 (600): a', '|', '`-  395 (395): c', '|', '`-      5 (5): tiny'],
+                         [line for line in lines if 'Counts' not in line and 'Larges' not in line])
+
+    def test_recursive_pruned(self):
+        out = io.StringIO()
+        self.tree.write_tree_display(out, size_renderer=str, max_depth=None, threshold=1, buffer_nodes=1)
+        lines = [line for line in out.getvalue().split('\n') if line and 'Counts' not in line and 'Larges' not in line]
+        self.assertEqual(['+1000 (1000): /r', '|', '`-  600 (600): a', '|  |', '|  `-  500 (500): b',
+                          '|', '`-  395 (395): c', '|', '`-             (1 folder below 1%)'], lines)
+        out = io.StringIO()
+        self.tree.write_tree_display(out, size_renderer=str, max_depth=None, threshold=0.6)
+        self.assertIn('(1 folder below 0.6%)', out.getvalue())
+
+    def test_detail_prefix(self):
+        # Detail lines keep the "|" of the folders that follow, at every depth
+        lines = self.tree.tree_display(size_renderer=str, max_depth=None).split('\n')
+        self.assertEqual(['       Counts: 0,0', '|      Counts: 0,0', '|         Counts: 0,0', '|      Counts: 0,0', '       Counts: 0,0'],
+                         [line for line in lines if 'Counts' in line])
+
+    def test_index(self):
+        index = treequery.TreeIndex(self.tree)
+        for max_depth, threshold in [(1, 0), (None, 1), (None, 50)]:
+            self.assertEqual(self.tree.tree_display(size_renderer=str, max_depth=max_depth, threshold=threshold),
+                             self.tree.tree_display(size_renderer=str, max_depth=max_depth, threshold=threshold, index=index))
+        self.assertEqual(self.tree.block_display(40), self.tree.block_display(40, index=index))
+        a = index.lookup('/r/a')
+        self.assertEqual(a.tree_display(size_renderer=str), a.tree_display(size_renderer=str, index=index, path='/r/a'))
+
+    def test_probe_width(self):
+        for size in [0, 7, 999, 1023, 5000, 1 << 20, 123456789]:
+            width = duviz.probe_width(duviz.human_readable_byte_size, size)
+            self.assertTrue(all(len(duviz.human_readable_byte_size(s)) <= width for s in range(0, size + 1, max(1, size // 997))))
+
+    def test_dump(self):
+        out = io.StringIO()
+        duviz2_tree(SpillTreeTest.lines).Dump(0, 1, out=out)
+        lines = out.getvalue().split('\n')
+        self.assertEqual("0:6(6)-323(323) '/r'", lines[0])
+        self.assertEqual(['0', '1', '1', '1'], [line.split(':')[0] for line in lines if not line.startswith(' ') and line])
+
+
 class BuildDuTreeTest(unittest.TestCase):
 
     def test_build_du_tree1(self):
         dir = 'path/to'
-        du_pipe = StringIO.StringIO(textwrap.dedent('''\
+        du_pipe = io.StringIO(textwrap.dedent('''\
             120     path/to/foo
             10      path/to/bar/a
             163     path/to/bar/b
@@ -139,7 +1028,7 @@ class BuildDuTreeTest(unittest.TestCase):
 
     def test_build_du_tree2(self):
         dir = 'path/to'
-        du_pipe = StringIO.StringIO(textwrap.dedent('''\
+        du_pipe = io.StringIO(textwrap.dedent('''\
             1       path/to/A
             1       path/to/b
             2       path/to/C
@@ -157,115 +1046,5 @@ class BuildDuTreeTest(unittest.TestCase):
         self.assertEqual(expected.split(), result.split())
 
 
-class BuildInodeCountTreeBsdLsTest(unittest.TestCase):
-    '''
-    For BSD version of ls
-    '''
-
-    def assertInputOuput(self, directory, ls_str, expected, width=40):
-        ls_pipe = StringIO.StringIO(ls_str)
-        tree = duviz._build_inode_count_tree(directory, ls_pipe, feedback=None)
-        result = tree.block_display(width=width, size_renderer=duviz.human_readable_count)
-        self.assertEqual(expected.split('\n'), result.split('\n'))
-
-    def test_build_inode_count_tree_simple(self):
-        self.assertInputOuput(
-            directory='path/to',
-            ls_str=textwrap.dedent('''\
-                222 .
-                  1 ..
-                333 file.txt
-                444 anotherfile.txt
-            '''),
-            expected=textwrap.dedent('''\
-                ________________________________________
-                [               path/to                ]
-                [__________________3___________________]''')
-        )
-
-    def test_build_inode_count_tree_with_hardlink(self):
-        self.assertInputOuput(
-            directory='path/to',
-            ls_str=textwrap.dedent('''\
-                222 .
-                  1 ..
-                333 file.txt
-                444 anotherfile.txt
-                333 hardlink.txt
-            '''),
-            expected=textwrap.dedent('''\
-                ________________________________________
-                [               path/to                ]
-                [__________________3___________________]''')
-        )
-
-    def test_build_inode_count_tree_subdir(self):
-        self.assertInputOuput(
-            directory='path/to',
-            ls_str=textwrap.dedent('''\
-                222 .
-                  1 ..
-                333 file.txt
-                444 directory
-                555 anotherfile.txt
-
-                path/to/directory:
-                444 .
-                222 ..
-                666 devil.txt
-                777 god.txt
-            '''),
-            expected=textwrap.dedent('''\
-                ________________________________________
-                [               path/to                ]
-                [__________________6___________________]
-                [ directory ]                           \n\
-                [_____2_____]                           ''')
-        )
-
-    def test_build_inode_count_tree_various(self):
-        self.assertInputOuput(
-            directory='path/to',
-            ls_str=textwrap.dedent('''\
-                2395 .
-                2393 ..
-                2849 bar
-                1166 barln
-                2845 a.txt
-                2846 b b b.txt
-                2842 c.txt
-
-                path/to/A:
-                2849 .
-                2395 ..
-                2851 d.txt
-                2852 e.txt
-
-                path/to/B:
-                1166 .
-                2395 ..
-                2852 bla.txt
-                1174 zaza
-            '''),
-            expected=textwrap.dedent('''\
-                ________________________________________
-                [               path/to                ]
-                [__________________9___________________]
-                [  A   ][ B ]                           \n\
-                [__2___][_1_]                           ''')
-        )
-
-
-class BuildInodeCountTreeGnuLsTest(BuildInodeCountTreeBsdLsTest):
-    '''
-    For GNU version of ls
-    '''
-
-    def assertInputOuput(self, directory, ls_str, expected, width=40):
-        ls_str = directory + ':\n' + ls_str
-        BuildInodeCountTreeBsdLsTest.assertInputOuput(self, directory, ls_str, expected, width)
-
-
-
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,248 @@
+'''
+Machine readable output of directory trees: NDJSON, CSV and a compact binary format.
+
+Every record holds the path and depth of a directory, followed by the
+selected columns. Records are collected in a buffer and written to the
+(binary) output stream in bulk.
+
+The writers can be fed from a built tree (write_tree) or directly from a
+scan (see duviz.build_du_tree(writer=...)), in which case directories are
+written in post-order, as soon as their totals are known.
+
+All text in the output is valid UTF-8, for strict consumers: file names
+that are not (surrogate escaped by os.listdir) are written with their
+undecodable bytes as \\xNN escapes, the same in every format (see
+printable_name).
+
+Binary format (all little endian):
+    header:  b'DUVZ', version (B), column count (B),
+             per column: name length (B), name (utf-8), type (B: 'q' or 's')
+    record:  depth (H), path length (I), path (utf-8),
+             per column: int64 value, or string length (I) + string (utf-8)
+'''
+
+import csv
+import io
+import json
+import os
+import struct
+
+
+# Column name -> (DirectoryTreeNode attribute, DirectoryTree attribute)
+COLUMNS = {
+    'size': ('size', 'totSize'),
+    'alloc': ('allocSize', 'totAlloc'),
+    'own_size': ('mySize', 'mySize'),
+    'own_alloc': ('myAllocSize', 'myAlloc'),
+    'files': ('fileCount', 'totCount'),
+    'own_files': ('myFileCount', 'myCount'),
+    'largest': ('largestFileSize', 'maxFileSize'),
+    'largest_name': ('largestFileName', 'maxFileName'),
+    'folders': ('folderCount', 'totFold'),
+}
+
+STRING_COLUMNS = set(['largest_name'])
+
+DEFAULT_COLUMNS = ['size', 'alloc', 'files']
+
+FORMATS = ['ndjson', 'csv', 'binary']
+
+
+def parse_columns(text):
+    '''
+    Parse a comma separated list of column names.
+    @raise ValueError on unknown column names
+    '''
+    columns = [c.strip() for c in text.split(',') if c.strip()]
+    for c in columns:
+        if c not in COLUMNS:
+            raise ValueError('unknown column "%s" (choose from %s)' % (c, ', '.join(sorted(COLUMNS))))
+    return columns
+
+
+def printable_name(name):
+    '''
+    @return the name as written: undecodable bytes of a file name that is not
+        valid UTF-8 (surrogate escaped) replaced by \\xNN escapes
+    '''
+    try:
+        name.encode('utf-8')
+        return name
+    except UnicodeEncodeError:
+        return os.fsencode(name).decode('utf-8', 'backslashreplace')
+
+
+def _subnodes(node):
+    if hasattr(node, '_subnodes'):
+        return node._subnodes
+    return node.subnodes
+
+
+class TreeWriter(object):
+    '''
+    Base class of the output writers.
+    @param out binary file object to write to
+    @param columns list of column names (see COLUMNS)
+    @param buffer_size number of buffered bytes that triggers a write
+    '''
+
+    def __init__(self, out, columns=None, buffer_size=1 << 16):
+        self.out = out
+        self.columns = list(columns or DEFAULT_COLUMNS)
+        self.buffer_size = buffer_size
+        self._chunks = []
+        self._buffered = 0
+        self._attrs = None
+        self._names = [i for i, c in enumerate(self.columns) if c in STRING_COLUMNS]
+        self.count = 0
+        self.header()
+
+    def _attributes(self, node):
+        # Resolve the attribute names once, based on the node model of the first record.
+        if self._attrs is None:
+            model = 0 if hasattr(node, '_subnodes') else 1
+            self._attrs = [COLUMNS[c][model] for c in self.columns]
+        return self._attrs
+
+    def _write(self, data):
+        self._chunks.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._chunks:
+            self.out.write(b''.join(self._chunks))
+            self._chunks = []
+            self._buffered = 0
+
+    def close(self):
+        self.flush()
+        self.out.flush()
+
+    def header(self):
+        pass
+
+    def write_node(self, path, depth, node):
+        self.count += 1
+        values = [getattr(node, a) for a in self._attributes(node)]
+        for i in self._names:
+            values[i] = printable_name(values[i])
+        self._write(self.encode(printable_name(path), depth, values))
+
+    def encode(self, path, depth, values):
+        raise NotImplementedError
+
+
+class NdjsonWriter(TreeWriter):
+    '''One JSON object per line.'''
+
+    def encode(self, path, depth, values):
+        record = {'path': path, 'depth': depth}
+        record.update(zip(self.columns, values))
+        return (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+class CsvWriter(TreeWriter):
+    '''CSV with a header line.'''
+
+    def header(self):
+        self._text = io.StringIO()
+        self._csv = csv.writer(self._text, lineterminator='\n')
+        self._csv.writerow(['path', 'depth'] + self.columns)
+        self._write(self._take())
+
+    def _take(self):
+        data = self._text.getvalue().encode('utf-8')
+        self._text.seek(0)
+        self._text.truncate()
+        return data
+
+    def encode(self, path, depth, values):
+        self._csv.writerow([path, depth] + values)
+        return self._take()
+
+
+class BinaryWriter(TreeWriter):
+    '''Compact binary records, see module documentation.'''
+
+    MAGIC = b'DUVZ'
+    VERSION = 1
+
+    def header(self):
+        parts = [self.MAGIC, struct.pack('<BB', self.VERSION, len(self.columns))]
+        for c in self.columns:
+            name = c.encode('utf-8')
+            parts.append(struct.pack('<B', len(name)) + name)
+            parts.append(b's' if c in STRING_COLUMNS else b'q')
+        self._write(b''.join(parts))
+        self._string = [c in STRING_COLUMNS for c in self.columns]
+
+    def encode(self, path, depth, values):
+        path = path.encode('utf-8')
+        parts = [struct.pack('<HI', depth, len(path)), path]
+        for is_string, value in zip(self._string, values):
+            if is_string:
+                value = value.encode('utf-8')
+                parts.append(struct.pack('<I', len(value)))
+                parts.append(value)
+            else:
+                parts.append(struct.pack('<q', int(value)))
+        return b''.join(parts)
+
+
+def read_binary(stream):
+    '''
+    Parse the binary format.
+    @return (column names, generator of (path, depth, values) tuples)
+    '''
+    if stream.read(4) != BinaryWriter.MAGIC:
+        raise ValueError('not a duviz binary tree stream')
+    version, ncols = struct.unpack('<BB', stream.read(2))
+    if version != BinaryWriter.VERSION:
+        raise ValueError('unsupported version %d' % version)
+    columns = []
+    types = []
+    for i in range(ncols):
+        length, = struct.unpack('<B', stream.read(1))
+        columns.append(stream.read(length).decode('utf-8'))
+        types.append(stream.read(1))
+
+    def records():
+        while True:
+            head = stream.read(6)
+            if len(head) < 6:
+                return
+            depth, length = struct.unpack('<HI', head)
+            path = stream.read(length).decode('utf-8')
+            values = []
+            for t in types:
+                if t == b's':
+                    length, = struct.unpack('<I', stream.read(4))
+                    values.append(stream.read(length).decode('utf-8'))
+                else:
+                    values.append(struct.unpack('<q', stream.read(8))[0])
+            yield path, depth, values
+
+    return columns, records()
+
+
+def get_writer(name, out, columns=None):
+    '''Create a writer for the given format name (see FORMATS).'''
+    writers = {'ndjson': NdjsonWriter, 'csv': CsvWriter, 'binary': BinaryWriter}
+    return writers[name](out, columns)
+
+
+def write_tree(tree, writer, max_depth=None, path=None, depth=0):
+    '''
+    Write a built tree (DirectoryTreeNode or DirectoryTree) in pre-order,
+    down to max_depth levels below the root.
+    '''
+    todo = [(tree, path or tree.name, depth)]
+    while todo:
+        node, path, depth = todo.pop()
+        writer.write_node(path, depth, node)
+        if max_depth is None or depth < max_depth:
+            subnodes = _subnodes(node)
+            for name in sorted(subnodes, reverse=True):
+                todo.append((subnodes[name], os.path.join(path, name), depth + 1))
@@ -0,0 +1,302 @@
+'''
+Treemap report: a squarified treemap of a directory tree as static HTML/SVG,
+for trees too large for the terminal (see DirectoryTreeNode.block_display).
+
+    export(tree, 'report')   ->   report/index.html
+                                  report/chunks/c<N>.js
+
+The page shows the top levels of the tree as inline SVG. Clicking a folder
+zooms in: its own view (precomputed, laid out for the full picture) is loaded
+from a chunk file. Chunks are JSONP scripts (duvizTreemap.load({...})) rather
+than plain JSON, so zooming also works for a report opened from disk (file://).
+
+Level of detail: the subfolders of a folder that would get less than min_area
+square pixels are not drawn (nor visited), they are merged into one "other"
+tile per folder. A view shows at most `levels` levels below its root. So the
+number of tiles per view is bounded by the picture area, and the work per view
+only depends on the visible folders, not on the size of the tree. At most
+max_chunks views are written (breadth first: the largest, shallowest folders
+first), the remaining folders are not zoomable: their tiles get a dashed
+border and export() returns how many there are.
+'''
+
+import html
+import json
+import os
+
+# Height of the name strip at the top of a folder tile, padding around the subfolder tiles
+HEADER = 14
+PAD = 2
+
+# Tile fields, in the order of the chunk "tiles" arrays. zoom: chunk id of the
+# folder's view, 0 if it has no subfolders, NO_VIEW if max_chunks was reached.
+TILE_FIELDS = ['x', 'y', 'w', 'h', 'depth', 'other', 'zoom', 'name', 'size']
+NO_VIEW = -1
+
+COLORS = ['#4e79a7', '#f28e2b', '#59a14f', '#e15759', '#76b7b2', '#edc948', '#b07aa1']
+OTHER_COLOR = '#bab0ac'
+
+
+def _subnodes(node):
+    if hasattr(node, '_subnodes'):
+        return node._subnodes
+    return node.subnodes
+
+
+def _size(node):
+    # DirectoryTreeNode (duviz) or accumulated DirectoryTree (duviz2)
+    size = node.size if hasattr(node, '_subnodes') else node.totSize
+    return size or 0
+
+
+def _worst(total, largest, smallest, side):
+    # Worst aspect ratio of a row of tiles (areas) along a side, see squarify()
+    side2 = side * side
+    total2 = total * total
+    return max(largest * side2 / total2, total2 / (side2 * smallest))
+
+
+def squarify(areas, x, y, w, h):
+    '''
+    Squarified treemap layout (Bruls, Huizing, van Wijk): split a rectangle
+    in tiles of the given areas with aspect ratios close to 1.
+
+    @param areas positive areas, largest first, summing up to (about) w * h
+    @return list of (x, y, w, h) per area
+    '''
+    rects = []
+    i = 0
+    while i < len(areas) and w > 0 and h > 0:
+        # Fill a row along the short side while that improves the worst aspect ratio
+        side = min(w, h)
+        total = areas[i]
+        worst = _worst(total, areas[i], areas[i], side)
+        j = i + 1
+        while j < len(areas):
+            candidate = _worst(total + areas[j], areas[i], areas[j], side)
+            if candidate > worst:
+                break
+            total += areas[j]
+            worst = candidate
+            j += 1
+        if w >= h:
+            # column at the left
+            width = min(total / h, w)
+            top = y
+            for area in areas[i:j]:
+                rects.append((x, top, width, area / width))
+                top += area / width
+            x += width
+            w -= width
+        else:
+            # row at the top
+            height = min(total / w, h)
+            left = x
+            for area in areas[i:j]:
+                rects.append((left, y, area / height, height))
+                left += area / height
+            y += height
+            h -= height
+        i = j
+    # Rounding left no room for the rest
+    rects.extend((x, y, 0, 0) for area in areas[len(rects):])
+    return rects
+
+
+def layout(node, width, height, levels=3, min_area=64, size_renderer=str):
+    '''
+    Lay out a view of node: node itself covers width x height pixels, its
+    subfolders are shown down to `levels` levels.
+
+    @return (tiles, zoomable) with tiles: list of TILE_FIELDS lists (zoom 0),
+        zoomable: list of (tile index, node, path relative to node) of the
+        shown subfolders that have subfolders of their own
+    '''
+    tiles = []
+    zoomable = []
+
+    def add(node, size, parent_rel, x, y, w, h, depth):
+        tiles.append([round(x, 1), round(y, 1), round(w, 1), round(h, 1), depth, 0, 0, node.name, size_renderer(size)])
+        subnodes = _subnodes(node)
+        if not subnodes:
+            return
+        rel = os.path.join(parent_rel, node.name) if depth > 0 else ''
+        if depth > 0:
+            zoomable.append((len(tiles) - 1, node, rel))
+        if depth >= levels or size <= 0:
+            return
+        header = HEADER if h >= 2 * HEADER and w >= 3 * HEADER else PAD
+        x, y, w, h = x + PAD, y + header, w - 2 * PAD, h - header - PAD
+        if w * h < min_area:
+            return
+        # Only the subfolders that get at least min_area pixels are shown (and sorted),
+        # the others are summed up in one pass
+        scale = w * h / size
+        threshold = min_area / scale
+        shown = []
+        small = hidden = 0
+        for sub in subnodes.values():
+            sub_size = _size(sub)
+            if sub_size >= threshold:
+                shown.append((sub_size, sub))
+            else:
+                small += sub_size
+                hidden += 1
+        shown.sort(key=lambda item: item[0], reverse=True)
+        areas = [sub_size * scale for sub_size, sub in shown]
+        if small > 0:
+            areas.append(small * scale)
+        own = size - sum(sub_size for sub_size, sub in shown) - small
+        if own > 0:
+            # Files of the folder itself: the rest of the tile
+            areas.append(own * scale)
+        rects = squarify(areas, x, y, w, h)
+        for (sub_size, sub), (rx, ry, rw, rh) in zip(shown, rects):
+            add(sub, sub_size, rel, rx, ry, rw, rh, depth + 1)
+        if small > 0:
+            rx, ry, rw, rh = rects[len(shown)]
+            if rw * rh >= min_area:
+                tiles.append([round(rx, 1), round(ry, 1), round(rw, 1), round(rh, 1), depth + 1, 1, 0,
+                              '%d smaller folders' % hidden, size_renderer(small)])
+
+    add(node, _size(node), '', 0, 0, width, height, 0)
+    return tiles, zoomable
+
+
+def render_svg(chunk, width, height):
+    '''
+    @return inline SVG markup of a chunk, the same as the page script renders it
+    '''
+    parts = ['<svg id="map" xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" font-family="sans-serif" font-size="10">'
+             % (width, height)]
+    for x, y, w, h, depth, other, zoom, name, size in chunk['tiles']:
+        color = OTHER_COLOR if other else COLORS[depth % len(COLORS)]
+        if zoom == NO_VIEW:
+            attributes, note = ' class="noview"', ' (no view: report limit reached)'
+        else:
+            attributes, note = (' data-zoom="%d" class="zoom"' % zoom if zoom else ''), ''
+        parts.append('<g%s><title>%s %s%s</title><rect x="%s" y="%s" width="%s" height="%s" fill="%s" stroke="#fff"/>'
+                     % (attributes, html.escape(name), html.escape(size), note, x, y, w, h, color))
+        if w >= 40 and h >= 12:
+            parts.append('<text x="%s" y="%s">%s</text>' % (round(x + 3, 1), round(y + 11, 1), html.escape(name[:int(w / 6)])))
+        parts.append('</g>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+PAGE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>%(title)s</title>
+<style>
+body { font-family: sans-serif; margin: 8px; }
+#map .zoom { cursor: zoom-in; }
+#map .noview rect { stroke: #333; stroke-dasharray: 4 2; }
+#map text { pointer-events: none; fill: #fff; }
+#up { visibility: hidden; }
+</style>
+</head>
+<body>
+<p><button id="up">Up</button> <span id="path">%(path)s</span></p>
+%(svg)s
+<script>
+var duvizTreemap = (function() {
+    var colors = %(colors)s, other = '%(other)s';
+    var parent = 0;
+    function escape(text) {
+        return String(text).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;').replace(/"/g, '&quot;');
+    }
+    function open(id) {
+        var script = document.createElement('script');
+        script.src = 'chunks/c' + id + '.js';
+        script.onload = function() { script.parentNode.removeChild(script); };
+        script.onerror = function() { alert('Could not load ' + script.src); };
+        document.head.appendChild(script);
+    }
+    function load(chunk) {
+        var parts = [];
+        chunk.tiles.forEach(function(t) {
+            var x = t[0], y = t[1], w = t[2], h = t[3];
+            var noview = t[6] == %(noview)d;
+            parts.push('<g' + (noview ? ' class="noview"' : t[6] ? ' data-zoom="' + t[6] + '" class="zoom"' : '') + '><title>' +
+                escape(t[7]) + ' ' + escape(t[8]) + (noview ? ' (no view: report limit reached)' : '') + '</title><rect x="' + x + '" y="' + y + '" width="' + w + '" height="' + h + '" fill="' +
+                (t[5] ? other : colors[t[4] %% colors.length]) + '" stroke="#fff"/>');
+            if (w >= 40 && h >= 12) {
+                parts.push('<text x="' + Math.round((x + 3) * 10) / 10 + '" y="' + Math.round((y + 11) * 10) / 10 + '">' +
+                    escape(t[7].slice(0, Math.floor(w / 6))) + '</text>');
+            }
+            parts.push('</g>');
+        });
+        document.getElementById('map').innerHTML = parts.join('');
+        document.getElementById('path').textContent = chunk.path;
+        document.getElementById('up').style.visibility = chunk.id ? 'visible' : 'hidden';
+        parent = chunk.parent;
+    }
+    document.getElementById('map').addEventListener('click', function(event) {
+        var g = event.target.closest('[data-zoom]');
+        if (g) {
+            open(g.getAttribute('data-zoom'));
+        }
+    });
+    document.getElementById('up').addEventListener('click', function() { open(parent); });
+    return {load: load, open: open};
+})();
+</script>
+</body>
+</html>
+'''
+
+
+def export(tree, directory, width=1200, height=800, levels=3, min_area=64, max_chunks=2000, size_renderer=str, path=None):
+    '''
+    Write a treemap report of a tree (DirectoryTreeNode or accumulated
+    DirectoryTree) to directory/index.html and directory/chunks, see the
+    module docstring.
+
+    @param width, height size of the picture in pixels
+    @param levels number of folder levels per view
+    @param min_area smaller subfolders (in square pixels) go in an "other" tile
+    @param max_chunks maximum number of views (the first one included)
+    @param path path of the tree root (default: its name)
+    @return (number of views written, number of shown folders with
+        subfolders left without a view because of max_chunks)
+    '''
+    chunks_dir = os.path.join(directory, 'chunks')
+    if not os.path.isdir(chunks_dir):
+        os.makedirs(chunks_dir)
+    path = path or tree.name
+    # Breadth first: (chunk id, parent chunk id, node, path)
+    todo = [(0, 0, tree, path)]
+    count = 1
+    no_view = set()  # ids of the folders shown without a view
+    first = None
+    for chunk_id, parent, node, path in todo:
+        tiles, zoomable = layout(node, width, height, levels, min_area, size_renderer)
+        for index, sub, rel in zoomable:
+            if count >= max_chunks:
+                tiles[index][6] = NO_VIEW
+                no_view.add(id(sub))
+                continue
+            tiles[index][6] = count
+            todo.append((count, chunk_id, sub, os.path.join(path, rel)))
+            count += 1
+        chunk = {'id': chunk_id, 'parent': parent, 'path': path, 'tiles': tiles}
+        with open(os.path.join(chunks_dir, 'c%d.js' % chunk_id), 'w', encoding='utf-8') as f:
+            f.write('duvizTreemap.load(%s);\n' % json.dumps(chunk, separators=(',', ':')))
+        if first is None:
+            first = chunk
+        # Done with this view: do not keep the (sub)trees of the queue around longer than needed
+        todo[chunk_id] = None
+
+    page = PAGE % {
+        'title': html.escape(first['path']),
+        'path': html.escape(first['path']),
+        'svg': render_svg(first, width, height),
+        'colors': json.dumps(COLORS),
+        'other': OTHER_COLOR,
+        'noview': NO_VIEW,
+    }
+    with open(os.path.join(directory, 'index.html'), 'w', encoding='utf-8', errors='replace') as f:
+        f.write(page)
+    return count, len(no_view)
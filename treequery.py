@@ -0,0 +1,148 @@
+'''
+Query layer over a built (rolled up) tree: a duviz.DirectoryTreeNode tree or
+an accumulated DirectoryTree.DirectoryTree tree.
+
+The indexes are built once in a single walk:
+ - path -> node, for O(1) lookups
+ - children of every folder, pre-sorted on size (largest first), also the
+   order of the tree and block displays (DirectoryTreeNode.write_tree_display)
+ - all folders sorted on size, for threshold queries (bisect) and top-k
+The tree must not change afterwards (e.g. in --watch mode): build a new index.
+'''
+
+import bisect
+import os
+import re
+
+# Size suffixes, binary multiples like duviz.human_readable_byte_size
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40, 'P': 1 << 50}
+
+_SIZE_RE = re.compile(r'^\s*([0-9.]+)\s*([KMGTP]?)(?:I?B)?\s*$', re.IGNORECASE)
+_QUERY_RE = re.compile(r'^\s*(size|top|path)\s*(>=|<=|>|<|=|:)\s*(.*?)\s*$')
+
+
+def parse_size(text):
+    '''
+    Parse a size like "1500", "100G", "1.5TiB" or "20MB" (binary multiples).
+    @raise ValueError on invalid sizes
+    '''
+    match = _SIZE_RE.match(text)
+    if not match:
+        raise ValueError('invalid size: %r' % text)
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+class TreeIndex(object):
+    '''
+    Indexes over a tree, see the module docstring.
+
+    @param tree root node
+    @param path path of the root node (default: its name, which is a full
+        path for the root of a scan but not for a subnode)
+    '''
+
+    def __init__(self, tree, path=None):
+        if hasattr(tree, '_subnodes'):
+            get_subnodes = lambda node: node._subnodes
+            self.size = lambda node: node.size
+        else:
+            get_subnodes = lambda node: node.subnodes
+            self.size = lambda node: node.totSize
+        size = self.size
+
+        self.tree = tree
+        self.nodes = {}     # path -> node
+        self.children = {}  # path -> [(child path, child node)], largest first
+        by_size = []
+        todo = [(path or tree.name, tree)]
+        while todo:
+            path, node = todo.pop()
+            self.nodes[path] = node
+            by_size.append((size(node), path))
+            subnodes = [(os.path.join(path, name), sub) for name, sub in get_subnodes(node).items()]
+            subnodes.sort(key=lambda item: size(item[1]), reverse=True)
+            self.children[path] = subnodes
+            todo.extend(subnodes)
+
+        by_size.sort()
+        self._sizes = [s for s, path in by_size]
+        self._paths = [path for s, path in by_size]
+
+    def __len__(self):
+        return len(self._paths)
+
+    def _key(self, path):
+        # Index key of a path: as given if indexed like that, otherwise the real path
+        return path if path in self.nodes else os.path.realpath(path)
+
+    def lookup(self, path):
+        '''@return the node of the given path, or None'''
+        return self.nodes.get(self._key(path))
+
+    def _results(self, start, stop):
+        # (size, path) of the size index slice, largest first
+        return [(self._sizes[i], self._paths[i]) for i in range(stop - 1, start - 1, -1)]
+
+    def larger_than(self, size, inclusive=False):
+        '''@return [(size, path)] of the folders over size, largest first'''
+        if inclusive:
+            return self._results(bisect.bisect_left(self._sizes, size), len(self._sizes))
+        return self._results(bisect.bisect_right(self._sizes, size), len(self._sizes))
+
+    def smaller_than(self, size, inclusive=False):
+        '''@return [(size, path)] of the folders under size, largest first'''
+        if inclusive:
+            return self._results(0, bisect.bisect_right(self._sizes, size))
+        return self._results(0, bisect.bisect_left(self._sizes, size))
+
+    def top(self, count):
+        '''@return [(size, path)] of the count largest folders'''
+        return self._results(max(0, len(self._sizes) - count), len(self._sizes))
+
+    def listing(self, path):
+        '''
+        @return [(size, path)] of the folder at path followed by its children, largest first
+        @raise KeyError if the path is not in the tree
+        '''
+        path = self._key(path)
+        node = self.nodes[path]
+        return [(self.size(node), path)] + [(self.size(sub), subpath) for subpath, sub in self.children[path]]
+
+    def subfolders(self, path):
+        '''
+        @return [(path, node)] of the subfolders of the folder at path, largest first
+        @raise KeyError if the path is not in the tree
+        '''
+        return self.children[self._key(path)]
+
+    def query(self, text):
+        '''
+        Run a query:
+            size>SIZE, size>=SIZE, size<SIZE, size<=SIZE   folders over/under SIZE (e.g. 100G)
+            top=N                                          the N largest folders
+            path=PATH                                      a folder and its children
+        @return [(size, path)]
+        @raise ValueError on invalid queries, KeyError for unknown paths
+        '''
+        match = _QUERY_RE.match(text)
+        if not match:
+            raise ValueError('invalid query: %r' % text)
+        field, op, value = match.groups()
+        if field == 'size' and op in ('>', '>='):
+            return self.larger_than(parse_size(value), inclusive=(op == '>='))
+        if field == 'size' and op in ('<', '<='):
+            return self.smaller_than(parse_size(value), inclusive=(op == '<='))
+        if field == 'top' and op in ('=', ':'):
+            return self.top(int(value))
+        if field == 'path' and op in ('=', ':'):
+            return self.listing(value)
+        raise ValueError('invalid query: %r' % text)
+
+
+def format_results(results, size_renderer):
+    '''@return report lines for query results'''
+    if not results:
+        return []
+    rendered = [size_renderer(size) for size, path in results]
+    wide = max(len(r) for r in rendered)
+    return ['{0:>{wide}}  {1}'.format(r, path, wide=wide) for r, (size, path) in zip(rendered, results)]
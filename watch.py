@@ -0,0 +1,322 @@
+'''
+Live mode: keep a scanned DirectoryTreeNode tree up to date.
+
+After the initial scan every directory is watched with inotify (Linux),
+or, where that is not available, polled: a directory is rescanned when its
+modification time, or the number, total size or latest modification time of
+its files changed. Polling stats every file of the tree once per interval.
+A change in a directory only rescans the files of that directory itself
+(plus newly created subdirectories) and propagates the size, allocated size
+and file count deltas up the ancestor chain, which is O(depth).
+
+Note that largest file, size histogram and extension table data are not
+decremented on changes: they reflect the initial scan plus later growth.
+The tree must not be built with folded directories (build_du_tree fold options).
+'''
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+import duviz
+import scanengine
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR)
+
+_EVENT = struct.Struct('iIII')
+
+# Seconds at most to wait for more events of a burst, to refresh once for all of them
+# (limited: a directory written to all the time must not hold up the refresh)
+COALESCE_TIME = 0.5
+
+
+class Inotify(object):
+    '''Minimal ctypes wrapper around the Linux inotify API.'''
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name or not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify not available')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def read_events(self, timeout):
+        '''
+        Wait up to timeout seconds for events.
+        @return list of (watch descriptor, mask, name) tuples
+        '''
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, length = _EVENT.unpack_from(data, pos)
+                pos += _EVENT.size
+                name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+                pos += length
+                events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def poll_signature(path):
+    '''
+    What polling compares to notice a change in a directory: the directory
+    modification time (entries created, removed or renamed) and the number,
+    total size and latest modification time of its files (files written in place).
+    '''
+    count = size = latest = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            count += 1
+            size += st.st_size
+            latest = max(latest, st.st_mtime_ns)
+    return (os.stat(path).st_mtime_ns, count, size, latest)
+
+
+class TreeWatcher(object):
+    '''
+    Incrementally updates a tree built by duviz.build_du_tree().
+    '''
+
+    def __init__(self, tree, use_inotify=True):
+        self.tree = tree
+        self.index = {}   # full path -> node
+        self.signatures = {}  # full path -> poll_signature() (polling mode)
+        self.inotify = None
+        self.watches = {}  # watch descriptor -> full path
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except OSError:
+                self.inotify = None
+        self._add(tree.name, tree)
+
+    def _add(self, path, node):
+        # Index (and watch) a subtree.
+        todo = [(path, node)]
+        while todo:
+            path, node = todo.pop()
+            self.index[path] = node
+            self._watch(path)
+            todo.extend((os.path.join(path, name), sub) for name, sub in node._subnodes.items())
+
+    def _watch(self, path):
+        if self.inotify is not None:
+            try:
+                self.watches[self.inotify.add_watch(path)] = path
+                return
+            except OSError as e:
+                if e.errno != errno.ENOSPC:
+                    return
+                # Out of watches: fall back to polling for everything.
+                self.inotify.close()
+                self.inotify = None
+                self.watches = {}
+                for p in self.index:
+                    self._watch(p)
+                return
+        try:
+            self.signatures[path] = poll_signature(path)
+        except OSError:
+            pass
+
+    def _remove(self, path, node):
+        todo = [(path, node)]
+        while todo:
+            path, node = todo.pop()
+            self.index.pop(path, None)
+            self.signatures.pop(path, None)
+            todo.extend((os.path.join(path, name), sub) for name, sub in node._subnodes.items())
+
+    def _propagate(self, path, d_size, d_alloc, d_count, d_folders, largest):
+        # Apply deltas to the ancestors of path, up to the root.
+        root = self.tree.name
+        while path != root:
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+            node = self.index[path]
+            node.size += d_size
+            node.allocSize += d_alloc
+            node.fileCount += d_count
+            node.folderCount += d_folders
+            if largest[0] > node.largestFileSize:
+                node.largestFileSize, node.largestFileName = largest
+
+    def refresh_dir(self, path):
+        '''
+        Rescan the files of one directory and update the tree.
+        @return True if the tree changed
+        '''
+        node = self.index.get(path)
+        if node is None:
+            return False
+        try:
+            files, folders = scanengine.list_folder(path)
+        except OSError:
+            return False  # gone: the parent directory event handles it
+
+        size = alloc = count = 0
+        largest = (0, '')
+        subdirs = set(name for name, ino in folders)
+        for name, st in files:
+            filesize = st.st_size
+            size += filesize
+            alloc += duviz.AllocatedSize(filesize)
+            count += 1
+            if filesize > largest[0]:
+                largest = (filesize, name)
+
+        d_size = size - node.mySize
+        d_alloc = alloc - node.myAllocSize
+        d_count = count - node.myFileCount
+        d_folders = 0
+        node.mySize, node.myAllocSize, node.myFileCount = size, alloc, count
+        node.myLargestFileSize, node.myLargestFileName = largest
+
+        for name in [n for n in node._subnodes if n not in subdirs]:
+            sub = node._subnodes.pop(name)
+            d_size -= sub.size
+            d_alloc -= sub.allocSize
+            d_count -= sub.fileCount
+            d_folders -= sub.folderCount + 1
+            self._remove(os.path.join(path, name), sub)
+
+        for name in subdirs.difference(node._subnodes):
+            fullpath = os.path.join(path, name)
+            try:
+                sub = duviz.build_du_tree(fullpath, feedback=None)
+            except OSError:
+                continue
+            sub.name = name
+            node._subnodes[name] = sub
+            d_size += sub.size
+            d_alloc += sub.allocSize
+            d_count += sub.fileCount
+            d_folders += sub.folderCount + 1
+            if sub.largestFileSize > largest[0]:
+                largest = (sub.largestFileSize, sub.largestFileName)
+            self._add(fullpath, sub)
+
+        if largest[0] > node.largestFileSize:
+            node.largestFileSize, node.largestFileName = largest
+        if not (d_size or d_alloc or d_count or d_folders):
+            return False
+        node.size += d_size
+        node.allocSize += d_alloc
+        node.fileCount += d_count
+        node.folderCount += d_folders
+        self._propagate(path, d_size, d_alloc, d_count, d_folders, largest)
+        return True
+
+    def changed_dirs(self, timeout):
+        '''
+        Wait up to timeout seconds for changes.
+        @return set of directory paths to refresh
+        '''
+        if self.inotify is not None:
+            dirty = set()
+            events = self.inotify.read_events(timeout)
+            # Coalesce bursts (e.g. a file being written) into one update.
+            deadline = time.time() + COALESCE_TIME
+            more = events
+            while more and time.time() < deadline:
+                more = self.inotify.read_events(min(0.05, max(0, deadline - time.time())))
+                events.extend(more)
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    return set(self.index)
+                path = self.watches.get(wd)
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                elif path is not None:
+                    dirty.add(path)
+            return dirty
+
+        time.sleep(timeout)
+        dirty = set()
+        for path, signature in list(self.signatures.items()):
+            try:
+                current = poll_signature(path)
+            except OSError:
+                continue
+            if current != signature:
+                self.signatures[path] = current
+                dirty.add(path)
+        return dirty
+
+    def update(self, timeout):
+        '''
+        Wait for changes and apply them.
+        @return True if the tree changed
+        '''
+        changed = False
+        # Parents first, so removed subtrees are dropped before they are visited.
+        for path in sorted(self.changed_dirs(timeout), key=len):
+            changed = self.refresh_dir(path) or changed
+        return changed
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+
+def watch(tree, render, interval=2.0, use_inotify=True):
+    '''
+    Keep updating the tree and call render() after every change, until interrupted.
+    '''
+    watcher = TreeWatcher(tree, use_inotify=use_inotify)
+    render()
+    try:
+        while True:
+            if watcher.update(interval):
+                render()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()